@@ -0,0 +1,315 @@
+"""Benchmarks for the local task store and list building (no Kivy needed).
+
+    python bench.py                              # 1k, 10k, 100k tasks
+    python bench.py --sizes 1000,1000000 --out bench.json
+    python bench.py --compare bench_before.json  # show change vs. an old run
+
+Every size runs against a fresh temporary database seeded with synthetic
+tasks. Results (p50/p99 latency, throughput) are written as JSON.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import database
+from task_store import TaskStore
+from screens.task_adapter import tasks_to_rows
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+# rows per apply_snapshot_page call, as sync_engine.PULL_PAGE_SIZE
+SNAPSHOT_PAGE_SIZE = 1000
+WORDS = (
+    "buy milk call mom write report fix bug review pull request book flight "
+    "pay rent clean kitchen plan trip water plants read chapter renew passport"
+).split()
+
+
+def make_task(i, rng):
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "title": " ".join(rng.choices(WORDS, k=3)) + f" #{i}",
+        "description": " ".join(rng.choices(WORDS, k=8)),
+        "completed": rng.random() < 0.5,
+    }
+
+
+def make_server_rows(tasks, rng, changed_fraction=0.01):
+    """Fake server delta: a few edits, a few tombstones, a few new rows."""
+    n = max(1, int(len(tasks) * changed_fraction))
+    rows = []
+    for t in rng.sample(tasks, n):
+        rows.append(dict(t, title=t["title"] + " (edited)", updated_at="2030-01-01T00:00:00+00:00"))
+    for t in rng.sample(tasks, max(1, n // 4)):
+        rows.append({"id": t["id"], "deleted": True, "updated_at": "2030-01-01T00:00:00+00:00"})
+    rows.extend(make_task(len(tasks) + i, rng) for i in range(n))
+    return rows
+
+
+# -------------------------------------------------
+# TIMING
+# -------------------------------------------------
+def measure(fn, repeat, setup=None):
+    """Call fn() repeat times; returns per-call durations in seconds."""
+    samples = []
+    for i in range(repeat):
+        arg = setup(i) if setup else None
+        start = time.perf_counter()
+        fn(arg) if setup else fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def memory_per_task(build, size):
+    """Bytes allocated per task by build() (what it returns is kept alive)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return used / max(size, 1)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    k = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize(name, size, samples, rows_per_call=1):
+    total = sum(samples)
+    return {
+        "name": name,
+        "size": size,
+        "calls": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "ops_per_s": len(samples) / total if total else None,
+        "rows_per_s": len(samples) * rows_per_call / total if total else None,
+    }
+
+
+# -------------------------------------------------
+# SCENARIOS
+# -------------------------------------------------
+def run_size(size, workdir, repeat, rng):
+    """Seed a fresh database with size tasks and time every operation."""
+    path = os.path.join(workdir, f"bench_{size}.db")
+    database.configure(path=path)
+    database.create_tables()
+
+    tasks = [make_task(i, rng) for i in range(size)]
+    ids = [t["id"] for t in tasks]
+    results = []
+
+    def add(name, samples, rows_per_call=1):
+        r = summarize(name, size, samples, rows_per_call)
+        results.append(r)
+        print(
+            f"  {name:<28} p50 {r['p50_ms']:9.3f} ms  p99 {r['p99_ms']:9.3f} ms"
+            f"  {r['rows_per_s'] or 0:14,.0f} rows/s"
+        )
+
+    start = time.perf_counter()
+    database.import_tasks(tasks, synced=True)
+    add("import_tasks", [time.perf_counter() - start], size)
+
+    # whole-table reads get few repetitions at large sizes
+    scan_repeat = max(3, min(repeat, 200_000 // size))
+
+    add("list_tasks_local", measure(database.list_tasks_local, scan_repeat), size)
+    add(
+        "iter_tasks_local",
+        measure(lambda: sum(1 for _ in database.iter_tasks_local()), scan_repeat),
+        size,
+    )
+    add(
+        "list_tasks_page(500)",
+        measure(lambda: database.list_tasks_page(limit=500), repeat),
+        min(500, size),
+    )
+    add(
+        "list_rows_headless",
+        measure(
+            lambda: tasks_to_rows(
+                database.iter_tasks_local(columns=("id", "title", "description", "completed"))
+            ),
+            scan_repeat,
+        ),
+        size,
+    )
+    store = TaskStore()
+    add("task_store.load", measure(store.load, scan_repeat), size)
+    add("task_store.rows", measure(store.rows, repeat), size)
+    probes = [store]
+
+    def store_rows():
+        # the probe stays referenced, so its index is counted too
+        probe = TaskStore()
+        probes.append(probe)
+        return probe.rows()
+
+    for name, build in (
+        ("list_of_dicts", database.list_tasks_local),
+        ("task_store", store_rows),
+    ):
+        per_task = memory_per_task(build, size)
+        results.append({"name": f"memory:{name}", "size": size, "bytes_per_task": per_task})
+        print(f"  {'memory:' + name:<28} {per_task:9.0f} bytes/task")
+    # stores left listening would re-read rows after every later write
+    for probe in probes:
+        probe.close()
+
+    add("task_counts", measure(database.task_counts, repeat))
+    add(
+        "list_tasks_page(open,500)",
+        measure(lambda: database.list_tasks_page(limit=500, where="open"), repeat),
+        min(500, size),
+    )
+    add(
+        "get_tasks_local(1)",
+        measure(lambda tid: database.get_tasks_local([tid]), repeat, setup=lambda i: rng.choice(ids)),
+    )
+    add(
+        "search_tasks_local",
+        measure(
+            lambda q: database.search_tasks_local(q, 50),
+            repeat,
+            setup=lambda i: rng.choice(WORDS)[:3],
+        ),
+    )
+    add(
+        "update_task_local",
+        measure(
+            lambda tid: database.update_task_local(tid, title="updated"),
+            repeat,
+            setup=lambda i: rng.choice(ids),
+        ),
+    )
+    burst = [rng.choice(ids) for _ in range(100)]
+
+    def group_commit():
+        database.set_write_scheduler(lambda flush: None)  # flush by hand
+        try:
+            for tid in burst:
+                database.submit_write(database.update_task_local, tid, title="burst")
+            database.flush_writes()
+        finally:
+            database.set_write_scheduler(None)
+
+    add(
+        "update_x100_separate",
+        measure(lambda: [database.update_task_local(t, title="burst") for t in burst], 5),
+        100,
+    )
+    add("update_x100_group_commit", measure(group_commit, 5), 100)
+    add(
+        "add_task_local",
+        measure(lambda: database.add_task_local("benchmark task", "desc"), repeat),
+    )
+
+    entries = database.pending_outbox(10_000)
+    add("pending_outbox", measure(lambda: database.pending_outbox(500), repeat), 500)
+    add("ack_outbox", measure(lambda: database.ack_outbox(entries), 1), len(entries))
+
+    # sync local write phases against fake server responses
+    delta = make_server_rows(tasks, rng)
+    add("apply_remote_changes", measure(lambda: database.apply_remote_changes(delta), 1), len(delta))
+    live = [t for t in tasks if t["id"] not in {r["id"] for r in delta if r.get("deleted")}]
+
+    def snapshot():
+        # a full download: one transaction per page, then drop what is gone
+        database.begin_snapshot()
+        for i in range(0, len(live), SNAPSHOT_PAGE_SIZE):
+            database.apply_snapshot_page(live[i:i + SNAPSHOT_PAGE_SIZE])
+        database.finish_snapshot()
+
+    add("snapshot_download", measure(snapshot, 1), len(live))
+    prefix = live[0]["id"][:database.DIGEST_PREFIX_LEN]
+    bucket = [t for t in live if t["id"].startswith(prefix)]
+    add(
+        "replace_bucket",
+        measure(lambda: database.replace_bucket(prefix, bucket), max(3, min(repeat, 20))),
+        len(bucket),
+    )
+
+    add(
+        "export_tasks(ndjson)",
+        measure(lambda: database.export_tasks(io.StringIO()), 1),
+        size,
+    )
+
+    victims = rng.sample(ids, min(repeat, len(ids)))
+    add("delete_task_local", measure(database.delete_task_local, len(victims), setup=lambda i: victims[i]))
+
+    database.close_connection()
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    print(f"\nChange in p50 vs {baseline_path} (negative is faster):")
+    for r in results:
+        old = baseline.get((r["name"], r["size"]))
+        if old and old.get("p50_ms") and "p50_ms" in r:
+            change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+            print(f"  {r['size']:>9} {r['name']:<28} {change:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the local task store")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="comma-separated task counts (e.g. 1000,1000000)",
+    )
+    parser.add_argument("--repeat", type=int, default=200, help="calls per single-row operation")
+    parser.add_argument("--profile", choices=sorted(database.PRAGMA_PROFILES), default=database.PRAGMA_PROFILE)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    database.configure(profile=args.profile)
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="todo_bench_")
+    results = []
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            print(f"{size:,} tasks")
+            results.extend(run_size(size, workdir, args.repeat, rng))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "profile": args.profile,
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
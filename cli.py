@@ -0,0 +1,282 @@
+"""Command-line tools for the local task store (no Kivy needed).
+
+    python cli.py import tasks.ndjson
+    python cli.py import tasks.csv --synced
+    python cli.py export backup.ndjson
+    python cli.py export - --format csv > tasks.csv
+    python cli.py list --where open
+    python cli.py add "Buy milk" --description "2 litres"
+    python cli.py complete --where open            # every open task
+    python cli.py delete ID [ID ...]               # or ids on stdin: delete -
+    python cli.py archive --days 7                 # then reclaim free space
+    python cli.py --email me@example.com push      # password from TODO_PASSWORD
+    python cli.py --email me@example.com sync --full
+
+Server commands (push, sync) sign in and then work on that account's own
+store. Supabase is imported only by those commands, so local ones start
+fast.
+"""
+import argparse
+import getpass
+import json
+import os
+import sys
+import time
+
+import database
+
+
+def _guess_format(path, fmt):
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def _open(path, mode):
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _report(action, count, started):
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"{action} {count} tasks in {elapsed:.2f}s ({rate:,.0f} rows/s)", file=sys.stderr)
+
+
+def _read_ids(args):
+    """Task ids from the command line, stdin ("-") or the --where filter."""
+    if args.ids == ["-"]:
+        return [line.strip() for line in sys.stdin if line.strip()]
+    if args.ids:
+        return args.ids
+    if args.where:
+        return [t["id"] for t in database.iter_tasks_local(5000, ("id",), args.where)]
+    raise SystemExit("give task ids, - for stdin, or --where")
+
+
+def _sign_in(args):
+    """Sign in and switch to the account's store (unless --db was given)."""
+    from supabase_client import sign_in
+
+    email = args.email or os.getenv("TODO_EMAIL")
+    if not email:
+        raise SystemExit("server commands need --email or TODO_EMAIL")
+    password = os.getenv("TODO_PASSWORD") or getpass.getpass(f"Password for {email}: ")
+    user = sign_in(email, password)
+    if not user:
+        raise SystemExit("sign-in failed")
+    if not args.db:
+        database.use_user_store(user["id"])
+    return user
+
+
+def cmd_list(args):
+    count = 0
+    out = sys.stdout
+    for task in database.iter_tasks_local(columns=("id", "title", "completed"), where=args.where):
+        if args.format == "ndjson":
+            out.write(json.dumps(task, ensure_ascii=False) + "\n")
+        else:
+            out.write(f"{task['id']}  [{'x' if task['completed'] else ' '}] {task['title']}\n")
+        count += 1
+    print(f"{count} tasks", file=sys.stderr)
+
+
+def cmd_add(args):
+    print(database.add_task_local(args.title, args.description))
+
+
+def cmd_complete(args):
+    started = time.perf_counter()
+    count = database.complete_tasks_local(_read_ids(args), not args.undo)
+    _report("Updated", count, started)
+
+
+def cmd_delete(args):
+    started = time.perf_counter()
+    count = database.delete_tasks_local(_read_ids(args))
+    _report("Deleted", count, started)
+
+
+def cmd_archive(args):
+    started = time.perf_counter()
+    result = database.run_maintenance(args.days)
+    print(f"Freed {result['vacuumed_pages']} pages", file=sys.stderr)
+    _report("Archived", result["archived"], started)
+
+
+def _push_all(sync_engine):
+    """Drain the outbox; returns the number of writes acknowledged.
+
+    Counted from the outbox itself: the engine's background drain may
+    push some of them before push_now() gets to.
+    """
+    before = database.outbox_counts()["pending"]
+    sync_engine.push_now().result()
+    return before - database.outbox_counts()["pending"]
+
+
+def _check_outbox():
+    """Exit non-zero if writes failed and are waiting for a retry."""
+    counts = database.outbox_counts()
+    if counts["stuck"]:
+        print(
+            f"{counts['stuck']} writes gave up after {database.OUTBOX_MAX_ATTEMPTS} "
+            "attempts; edit or delete those tasks to retry",
+            file=sys.stderr,
+        )
+    if counts["failed"]:
+        raise SystemExit(f"{counts['failed']} writes failed and stay queued for a retry")
+
+
+def cmd_push(args):
+    _sign_in(args)
+    from sync_engine import sync_engine
+
+    started = time.perf_counter()
+    queued = database.enqueue_unsynced()
+    if queued:
+        print(f"Queued {queued} unsynced tasks without a pending push", file=sys.stderr)
+    try:
+        count = _push_all(sync_engine)
+    finally:
+        sync_engine.stop()
+    _report("Pushed", count, started)
+    _check_outbox()
+
+
+def cmd_sync(args):
+    _sign_in(args)
+    from sync_engine import sync_engine
+
+    started = time.perf_counter()
+    database.enqueue_unsynced()
+    try:
+        pushed = _push_all(sync_engine)
+        pulled = sync_engine.pull(full=args.full).result()
+    finally:
+        sync_engine.stop()
+    print(f"Pushed {pushed}, pulled {pulled}", file=sys.stderr)
+    _report("Synced", pushed + pulled, started)
+    _check_outbox()
+
+
+def cmd_import(args):
+    fmt = _guess_format(args.path, args.format)
+    started = time.perf_counter()
+    f = _open(args.path, "r")
+    try:
+        reader = database.read_csv if fmt == "csv" else database.read_ndjson
+        count = database.import_tasks(
+            reader(f), synced=args.synced, chunk_size=args.chunk_size
+        )
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    _report("Imported", count, started)
+
+
+def cmd_export(args):
+    fmt = _guess_format(args.path, args.format)
+    started = time.perf_counter()
+    f = _open(args.path, "w")
+    try:
+        count = database.export_tasks(f, fmt)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    _report("Exported", count, started)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Todo app task store tools")
+    parser.add_argument("--db", help="SQLite file (default: offline.db)")
+    parser.add_argument("--user", help="use this user id's own store (offline_<id>.db)")
+    parser.add_argument("--email", help="account for push/sync (default: TODO_EMAIL)")
+    parser.add_argument(
+        "--profile",
+        choices=sorted(database.PRAGMA_PROFILES),
+        help="SQLite pragma profile",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="import tasks from NDJSON or CSV")
+    p.add_argument("path", help="input file, or - for stdin")
+    p.add_argument("--format", choices=["ndjson", "csv"])
+    p.add_argument(
+        "--synced",
+        action="store_true",
+        help="mark tasks as already on the server (do not queue a push)",
+    )
+    p.add_argument("--chunk-size", type=int, default=database.IMPORT_CHUNK_SIZE)
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("export", help="export tasks as NDJSON or CSV")
+    p.add_argument("path", help="output file, or - for stdout")
+    p.add_argument("--format", choices=["ndjson", "csv"])
+    p.set_defaults(func=cmd_export)
+
+    filters = sorted(database.TASK_FILTERS)
+
+    p = sub.add_parser("list", help="stream tasks, newest first")
+    p.add_argument("--where", choices=filters, default="all")
+    p.add_argument("--format", choices=["text", "ndjson"], default="text")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("add", help="add one task")
+    p.add_argument("title")
+    p.add_argument("--description", default="")
+    p.set_defaults(func=cmd_add)
+
+    for name, func, action in (
+        ("complete", cmd_complete, "mark tasks completed"),
+        ("delete", cmd_delete, "delete tasks"),
+    ):
+        p = sub.add_parser(name, help=f"{action} (one transaction)")
+        p.add_argument("ids", nargs="*", help="task ids, or - to read them from stdin")
+        p.add_argument("--where", choices=filters, help="select tasks by filter instead")
+        if name == "complete":
+            p.add_argument("--undo", action="store_true", help="mark as not completed")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("archive", help="archive old completed tasks and vacuum")
+    p.add_argument(
+        "--days",
+        type=float,
+        help=f"completed and unchanged this long (default: {database.ARCHIVE_AFTER_DAYS:g})",
+    )
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("push", help="push local changes to the server")
+    p.set_defaults(func=cmd_push)
+
+    p = sub.add_parser("sync", help="push, then pull server changes")
+    p.add_argument("--full", action="store_true", help="download everything again")
+    p.set_defaults(func=cmd_sync)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        _run(args)
+    except BrokenPipeError:
+        # output piped into e.g. head, which stopped reading
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+
+def _run(args):
+    if args.db or args.profile:
+        database.configure(path=args.db, profile=args.profile)
+    if args.user:
+        database.use_user_store(args.user)
+    else:
+        database.create_tables()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,354 @@
 # todo_python_app/database.py
+import csv
+import hashlib
+import json
+import os
+import re
 import sqlite3
+import threading
+import time
 import uuid
-from typing import List, Dict
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import List, Dict, Iterable, Iterator, Optional, Sequence, Tuple, TextIO
 
-DB_PATH = "offline.db"
+from stats import timed
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Shared file used when nobody is signed in (and by the CLI by default);
+# each account gets its own file, see use_user_store()
+DEFAULT_DB_PATH = "offline.db"
+USER_DB_TEMPLATE = "offline_{user_id}.db"
+DB_PATH = DEFAULT_DB_PATH
+# Owner recorded on tasks created locally (None in the shared store)
+STORE_USER_ID = None
+
+# -------------------------------------------------
+# CONNECTION MANAGER
+# -------------------------------------------------
+# One long-lived connection per thread (sqlite3 connections must not be
+# shared across threads). WAL lets the sync threads write while the UI
+# thread keeps reading.
+PRAGMA_PROFILES = {
+    # every commit is fsynced; slowest, survives power loss
+    "durable": {"synchronous": "FULL", "cache_size": -2000, "mmap_size": 0},
+    # WAL + NORMAL: safe against app crashes, cheap commits
+    "balanced": {
+        "synchronous": "NORMAL",
+        "cache_size": -8000,
+        "mmap_size": 64 * 1024 * 1024,
+    },
+    # for bulk jobs / benchmarks only, a power cut may corrupt the file
+    "fast": {
+        "synchronous": "OFF",
+        "cache_size": -32000,
+        "mmap_size": 256 * 1024 * 1024,
+    },
+}
+PRAGMA_PROFILE = os.getenv("TODO_DB_PROFILE", "balanced")
+BUSY_TIMEOUT_MS = 5000
+
+_local = threading.local()
+_generation = 0
+_change_listeners = []
+
+
+def configure(path: str = None, profile: str = None):
+    """Change the database file and/or pragma profile.
+
+    Existing per-thread connections are reopened lazily on their next use.
+    """
+    global DB_PATH, PRAGMA_PROFILE, _generation
+    if profile is not None:
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Unknown pragma profile: {profile}")
+        PRAGMA_PROFILE = profile
+    if path is not None:
+        DB_PATH = path
+    _generation += 1
+
+
+def user_db_path(user_id: str) -> str:
+    """Database file holding user_id's tasks, outbox and sync state."""
+    safe = re.sub(r"[^A-Za-z0-9_-]", "", user_id)
+    if not safe:
+        raise ValueError(f"Invalid user id: {user_id!r}")
+    folder = os.path.dirname(DEFAULT_DB_PATH)
+    return os.path.join(folder, USER_DB_TEMPLATE.format(user_id=safe))
+
+
+def use_user_store(user_id: Optional[str]):
+    """Switch to user_id's own database file (None: the shared default).
+
+    Every account keeps its cache, unpushed edits and sync high-water mark
+    across sign-outs, so signing back in only needs a delta pull. Change
+    listeners get a "reset" because everything they show has changed.
+    """
+    global STORE_USER_ID
+    path = user_db_path(user_id) if user_id else DEFAULT_DB_PATH
+    # queued writes belong to the store they were made in
+    flush_writes()
+    adopt = path != DEFAULT_DB_PATH and not os.path.exists(path) and os.path.exists(DEFAULT_DB_PATH)
+    if adopt:
+        # bring the shared file to the current schema before copying from it
+        configure(path=DEFAULT_DB_PATH)
+        create_tables()
+    STORE_USER_ID = user_id or None
+    if path != DB_PATH:
+        configure(path=path)
+    create_tables()
+    if adopt:
+        _adopt_shared_store(user_id)
+    _notify_changes([("reset", None)])
+
+
+def _adopt_shared_store(user_id: str):
+    """Move user_id's tasks and unpushed writes from the shared file into this one.
+
+    Runs when an account first gets its own file, e.g. after upgrading
+    from a single shared offline.db: rows owned by the account or by
+    nobody (created signed out) move over with their outbox entries and
+    the account's high-water mark, so unpushed edits are not stranded.
+    Rows owned by other accounts stay behind.
+    """
+    conn = get_connection()
+    conn.execute("ATTACH DATABASE ? AS shared", (DEFAULT_DB_PATH,))
+    try:
+        with transaction() as conn:
+            mine = "(user_id = ? OR user_id IS NULL)"
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO tasks
+                  (id, title, description, completed, synced, user_id, created_at, updated_at)
+                SELECT id, title, description, completed, synced,
+                       coalesce(user_id, ?), created_at, updated_at
+                FROM shared.tasks WHERE {mine}
+                """,
+                (user_id, user_id),
+            )
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO archived_tasks ({", ".join(ARCHIVE_COLUMNS)})
+                SELECT id, title, description, completed, coalesce(user_id, ?),
+                       created_at, updated_at, archived_at
+                FROM shared.archived_tasks WHERE {mine}
+                """,
+                (user_id, user_id),
+            )
+            # a delete leaves no row to tell its owner; take all but others' writes
+            others = """
+                SELECT id FROM shared.tasks WHERE user_id != ?
+                UNION ALL SELECT id FROM shared.archived_tasks WHERE user_id != ?
+            """
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO outbox
+                  (task_id, op, version, attempts, next_attempt_at, last_error)
+                SELECT task_id, op, version, attempts, next_attempt_at, last_error
+                FROM shared.outbox WHERE task_id NOT IN ({others})
+                """,
+                (user_id, user_id),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO sync_state (user_id, high_water) "
+                "SELECT user_id, high_water FROM shared.sync_state WHERE user_id = ?",
+                (user_id,),
+            )
+            conn.execute(
+                f"DELETE FROM shared.outbox WHERE task_id NOT IN ({others})",
+                (user_id, user_id),
+            )
+            conn.execute(f"DELETE FROM shared.tasks WHERE {mine}", (user_id,))
+            conn.execute(f"DELETE FROM shared.archived_tasks WHERE {mine}", (user_id,))
+            conn.execute("DELETE FROM shared.sync_state WHERE user_id = ?", (user_id,))
+    finally:
+        conn.execute("DETACH DATABASE shared")
+
+
+def _open_connection():
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+    # we manage transactions ourselves through transaction()
+    conn.isolation_level = None
     conn.row_factory = sqlite3.Row
+    # takes effect only on a new, empty file; vacuum_step() converts old ones
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    for name, value in PRAGMA_PROFILES[PRAGMA_PROFILE].items():
+        conn.execute(f"PRAGMA {name} = {value}")
     return conn
 
-def create_tables():
+
+def get_connection():
+    """Return this thread's long-lived connection (do not close it)."""
+    conn = getattr(_local, "conn", None)
+    # never swap the connection under an open transaction
+    if conn is not None and (_local.generation == _generation or _local.depth):
+        return conn
+    if conn is not None:
+        conn.close()
+    _local.conn = _open_connection()
+    _local.generation = _generation
+    _local.depth = 0
+    return _local.conn
+
+
+def close_connection():
+    """Close this thread's connection, e.g. when a worker thread exits."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+@contextmanager
+def transaction(immediate: bool = True):
+    """Run a block in one transaction on this thread's connection.
+
+    Commits on success and rolls back on error. Nested calls join the
+    outer transaction. Writers should keep immediate=True so the write
+    lock is taken up front instead of failing on upgrade.
+    """
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    _local.depth = 1
+    _local.changes = []
+    try:
+        yield conn
+        conn.commit()
+        changes = _local.changes
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _local.depth = 0
+        _local.changes = []
+    # outside the transaction, so listeners may query (or write) themselves
+    if changes:
+        _notify_changes(changes)
+
+
+# -------------------------------------------------
+# GROUP COMMIT
+# -------------------------------------------------
+# UI writes can be queued with submit_write() and committed together by
+# flush_writes(): one transaction (and one fsync) for every write made in
+# the same frame or window. Each write runs in its own savepoint, so a
+# failing one does not undo the others. Without a scheduler every write
+# is committed straight away.
+_write_lock = threading.Lock()
+_pending_writes = []
+_write_scheduler = None
+
+
+def set_write_scheduler(schedule):
+    """schedule(flush) must call flush() soon, e.g. on the next UI frame.
+
+    Pass None to commit each write immediately.
+    """
+    global _write_scheduler
+    _write_scheduler = schedule
+
+
+def submit_write(fn, *args, **kw) -> Future:
+    """Run fn(*args, **kw) in the next group commit.
+
+    Returns a Future that gets fn's result (e.g. the changed row) once
+    the group is committed, or its exception.
+    """
+    future = Future()
+    with _write_lock:
+        _pending_writes.append((future, fn, args, kw))
+        first = len(_pending_writes) == 1
+    if _write_scheduler is None:
+        flush_writes()
+    elif first:
+        _write_scheduler(flush_writes)
+    return future
+
+
+@timed("db.flush_writes", rows=lambda n: n)
+def flush_writes() -> int:
+    """Commit every queued write in one transaction; returns the count."""
+    with _write_lock:
+        batch = _pending_writes[:]
+        _pending_writes.clear()
+    if not batch:
+        return 0
+
+    outcomes = []
+    try:
+        with transaction() as conn:
+            for future, fn, args, kw in batch:
+                conn.execute("SAVEPOINT group_write")
+                try:
+                    result = fn(*args, **kw)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO group_write")
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+                conn.execute("RELEASE group_write")
+    except Exception as e:
+        print("Group commit failed:", e)
+        outcomes = [(future, None, e) for future, _, _, _ in batch]
+
+    for future, result, error in outcomes:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+    return len(batch)
+
+
+# -------------------------------------------------
+# CHANGE NOTIFICATIONS
+# -------------------------------------------------
+# Listeners get a list of (op, task_id) after each committed transaction
+# that touched tasks. op is "insert", "update", "delete", "archive" (moved
+# to archived_tasks) or "reset" (the whole table changed, task_id is
+# None). Remote upserts are reported as "update" even when the row is new
+# locally, and so is a push being acknowledged (synced flips to 1).
+# Listeners run on the writing thread, which may not be the UI thread.
+def add_change_listener(listener):
+    _change_listeners.append(listener)
+
+
+def remove_change_listener(listener):
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+
+def _record_change(op: str, task_id: str = None):
+    _local.changes.append((op, task_id))
+
+
+def _notify_changes(changes):
+    for listener in list(_change_listeners):
+        try:
+            listener(changes)
+        except Exception as e:
+            print("Change listener error:", e)
+
+
+# -------------------------------------------------
+# SCHEMA
+# -------------------------------------------------
+# The schema is versioned with PRAGMA user_version. Each migration runs
+# once, in order, inside the same transaction that bumps the version, so
+# an existing offline.db is upgraded in place on startup. Append new
+# migrations to MIGRATIONS; never edit one that has shipped.
+def _migrate_1(conn):
+    """Baseline: the tables as they were before versioning."""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS tasks (
       id TEXT PRIMARY KEY,
       title TEXT NOT NULL,
@@ -22,76 +357,1177 @@ def create_tables():
       synced INTEGER DEFAULT 0
     )
     """)
-    conn.commit()
-    conn.close()
+    # pending server writes, one row per task (later edits coalesce)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+      task_id TEXT PRIMARY KEY,
+      op TEXT NOT NULL,
+      version INTEGER NOT NULL DEFAULT 1,
+      attempts INTEGER NOT NULL DEFAULT 0,
+      next_attempt_at REAL NOT NULL DEFAULT 0,
+      last_error TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state (
+      user_id TEXT PRIMARY KEY,
+      high_water TEXT
+    )
+    """)
+    _create_search_index(conn)
+
+
+def _migrate_2(conn):
+    """Timestamps (unix seconds), owner and indexes for filtered queries."""
+    # ADD COLUMN cannot take an expression default, so writers set them
+    conn.execute("ALTER TABLE tasks ADD COLUMN created_at REAL")
+    conn.execute("ALTER TABLE tasks ADD COLUMN updated_at REAL")
+    conn.execute("ALTER TABLE tasks ADD COLUMN user_id TEXT")
+    now = time.time()
+    conn.execute("UPDATE tasks SET created_at = ?, updated_at = ?", (now, now))
+    # local edits not yet on the server, oldest first
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_unsynced ON tasks (updated_at) WHERE synced = 0"
+    )
+    # open and done tasks, newest first; also serve counts per status
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_open ON tasks (created_at DESC) WHERE completed = 0"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_done ON tasks (created_at DESC) WHERE completed = 1"
+    )
+    # covers per-user "newest change" lookups
+    conn.execute("CREATE INDEX IF NOT EXISTS tasks_user_updated ON tasks (user_id, updated_at)")
+
 
+def _migrate_3(conn):
+    """Trigger-maintained task counters and an index for status filters."""
+    conn.execute("""
+    CREATE TABLE task_counts (
+      id INTEGER PRIMARY KEY CHECK (id = 1),
+      total INTEGER NOT NULL,
+      completed INTEGER NOT NULL,
+      unsynced INTEGER NOT NULL
+    )
+    """)
+    conn.execute("""
+    INSERT INTO task_counts (id, total, completed, unsynced)
+    SELECT 1, count(*), total(completed = 1), total(synced = 0) FROM tasks
+    """)
+    # ifnull: a NULL flag counts as neither completed nor unsynced
+    conn.execute("""
+    CREATE TRIGGER task_counts_ai AFTER INSERT ON tasks BEGIN
+      UPDATE task_counts SET
+        total = total + 1,
+        completed = completed + ifnull(new.completed = 1, 0),
+        unsynced = unsynced + ifnull(new.synced = 0, 0);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER task_counts_ad AFTER DELETE ON tasks BEGIN
+      UPDATE task_counts SET
+        total = total - 1,
+        completed = completed - ifnull(old.completed = 1, 0),
+        unsynced = unsynced - ifnull(old.synced = 0, 0);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER task_counts_au AFTER UPDATE OF completed, synced ON tasks BEGIN
+      UPDATE task_counts SET
+        completed = completed + ifnull(new.completed = 1, 0) - ifnull(old.completed = 1, 0),
+        unsynced = unsynced + ifnull(new.synced = 0, 0) - ifnull(old.synced = 0, 0);
+    END
+    """)
+    # list pages are keyed on rowid: (completed, rowid) serves open/done
+    # pages in that order, which the created_at indexes could not
+    conn.execute("DROP INDEX IF EXISTS tasks_open")
+    conn.execute("DROP INDEX IF EXISTS tasks_done")
+    conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (completed)")
+    # (synced, rowid) for the unsynced view; partial, so it stays tiny
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_unsynced_rows ON tasks (synced) WHERE synced = 0"
+    )
+
+
+def _migrate_4(conn):
+    """Archive tier: old completed tasks move out of tasks (see archive_completed)."""
+    conn.execute("""
+    CREATE TABLE archived_tasks (
+      id TEXT PRIMARY KEY,
+      title TEXT NOT NULL,
+      description TEXT,
+      completed INTEGER DEFAULT 1,
+      user_id TEXT,
+      created_at REAL,
+      updated_at REAL,
+      archived_at REAL NOT NULL
+    )
+    """)
+    # archive candidates: completed tasks by last change
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_done_updated ON tasks (updated_at) WHERE completed = 1"
+    )
+
+
+def _migrate_5(conn):
+    """Drop indexes no query uses; each only added write cost."""
+    # no query filters on (user_id, updated_at): a store holds one user
+    conn.execute("DROP INDEX IF EXISTS tasks_user_updated")
+    # the unsynced view and counts use tasks_unsynced_rows (migration 3)
+    conn.execute("DROP INDEX IF EXISTS tasks_unsynced")
+
+
+MIGRATIONS = [_migrate_1, _migrate_2, _migrate_3, _migrate_4, _migrate_5]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def create_tables():
+    """Create the schema, or upgrade an older file to SCHEMA_VERSION."""
+    with transaction() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"{DB_PATH} has schema version {version}; this app supports up to {SCHEMA_VERSION}"
+            )
+        for number, migrate in enumerate(MIGRATIONS[version:], version + 1):
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+    conn.execute("PRAGMA optimize")
+
+
+_FTS_TRIGGERS = {
+    "tasks_fts_ai": """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN
+      INSERT INTO tasks_fts (rowid, title, description)
+      VALUES (new.rowid, new.title, new.description);
+    END
+    """,
+    "tasks_fts_ad": """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN
+      INSERT INTO tasks_fts (tasks_fts, rowid, title, description)
+      VALUES ('delete', old.rowid, old.title, old.description);
+    END
+    """,
+    "tasks_fts_au": """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF title, description ON tasks BEGIN
+      INSERT INTO tasks_fts (tasks_fts, rowid, title, description)
+      VALUES ('delete', old.rowid, old.title, old.description);
+      INSERT INTO tasks_fts (rowid, title, description)
+      VALUES (new.rowid, new.title, new.description);
+    END
+    """,
+}
+
+
+def _create_search_index(conn):
+    """FTS5 index over title/description, kept in sync by triggers."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'"
+    ).fetchone()
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+      title, description, content='tasks', content_rowid='rowid'
+    )
+    """)
+    for sql in _FTS_TRIGGERS.values():
+        conn.execute(sql)
+    if not exists:
+        # index rows that existed before the search index was added
+        conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+
+# Batches at least this big re-index search set-wise (see below)
+BULK_INDEX_MIN_ROWS = 200
+
+
+@contextmanager
+def _bulk_search_index(conn, task_ids: List[str]):
+    """Maintain the search index set-wise around a bulk write of task_ids.
+
+    FTS5 flushes its pending terms at every statement savepoint, so the
+    per-row triggers get very slow in executemany. Inside the caller's
+    transaction the triggers are dropped, the affected rows are
+    re-indexed with two INSERT ... SELECT statements and the triggers
+    are recreated. A rollback restores them too.
+    """
+    ids_json = json.dumps(task_ids)
+    for name in _FTS_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    # drop index entries of rows about to be overwritten or deleted
+    conn.execute(
+        """
+        INSERT INTO tasks_fts (tasks_fts, rowid, title, description)
+        SELECT 'delete', rowid, title, description FROM tasks
+        WHERE id IN (SELECT value FROM json_each(?))
+        """,
+        (ids_json,),
+    )
+    yield
+    conn.execute(
+        """
+        INSERT INTO tasks_fts (rowid, title, description)
+        SELECT rowid, title, description FROM tasks
+        WHERE id IN (SELECT value FROM json_each(?))
+        """,
+        (ids_json,),
+    )
+    for sql in _FTS_TRIGGERS.values():
+        conn.execute(sql)
+
+
+# -------------------------------------------------
+# TASKS
+# -------------------------------------------------
+@timed("db.add_task_local", rows=1)
 def add_task_local(title: str, description: str = "") -> str:
     """Add a task to local SQLite and return its id."""
     task_id = str(uuid.uuid4())
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO tasks (id, title, description, completed, synced) VALUES (?, ?, ?, 0, 0)",
-        (task_id, title, description),
-    )
-    conn.commit()
-    conn.close()
+    now = time.time()
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO tasks
+              (id, title, description, completed, synced, user_id, created_at, updated_at)
+            VALUES (?, ?, ?, 0, 0, ?, ?, ?)
+            """,
+            (task_id, title, description, STORE_USER_ID, now, now),
+        )
+        _enqueue(conn, task_id, "upsert")
+        _record_change("insert", task_id)
     return task_id
 
+
+@timed("db.list_tasks_local", rows=len)
 def list_tasks_local() -> List[Dict]:
     """Return list of local tasks as dicts (most recent first)."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, description, completed, synced FROM tasks ORDER BY rowid DESC")
-    rows = cur.fetchall()
-    conn.close()
+    with transaction(immediate=False) as conn:
+        rows = conn.execute(
+            "SELECT id, title, description, completed, synced FROM tasks ORDER BY rowid DESC"
+        ).fetchall()
     return [dict(r) for r in rows]
 
-def update_task_local(task_id: str, title: str = None, description: str = None, completed: bool = None):
-    conn = get_connection()
-    cur = conn.cursor()
-    if title is not None:
-        cur.execute("UPDATE tasks SET title = ? WHERE id = ?", (title, task_id))
-    if description is not None:
-        cur.execute("UPDATE tasks SET description = ? WHERE id = ?", (description, task_id))
+
+TASK_COLUMNS = (
+    "id", "title", "description", "completed", "synced",
+    "created_at", "updated_at", "user_id",
+)
+
+
+def _select_columns(columns: Optional[Sequence[str]], allowed=TASK_COLUMNS) -> str:
+    columns = columns or allowed
+    unknown = set(columns) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown task columns: {sorted(unknown)}")
+    return ", ".join(columns)
+
+
+# Named row filters for listings and bulk operations
+TASK_FILTERS = {
+    "all": "1",
+    "open": "completed = 0",
+    "done": "completed = 1",
+    "unsynced": "synced = 0",
+}
+
+
+def _filter_sql(where: str) -> str:
+    try:
+        return TASK_FILTERS[where]
+    except KeyError:
+        raise ValueError(f"Unknown task filter: {where}") from None
+
+
+@timed("db.list_tasks_page", rows=lambda r: len(r[0]))
+def list_tasks_page(
+    after: Optional[int] = None,
+    limit: int = 500,
+    columns: Optional[Sequence[str]] = None,
+    where: str = "all",
+) -> Tuple[List[Dict], Optional[int]]:
+    """Return one page of tasks (most recent first) and the next cursor.
+
+    Keyset pagination on rowid: pass the returned cursor as ``after`` to
+    get the following page. The cursor is None once the table is exhausted.
+    ``columns`` limits the fields returned (default: all task columns);
+    ``where`` names one of TASK_FILTERS.
+    """
+    select = _select_columns(columns)
+    condition = _filter_sql(where)
+    with transaction(immediate=False) as conn:
+        if after is None:
+            rows = conn.execute(
+                f"SELECT rowid AS _rowid, {select} FROM tasks WHERE {condition} "
+                "ORDER BY rowid DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                f"SELECT rowid AS _rowid, {select} FROM tasks WHERE {condition} "
+                "AND rowid < ? ORDER BY rowid DESC LIMIT ?",
+                (after, limit),
+            ).fetchall()
+
+    page = []
+    for r in rows:
+        d = dict(r)
+        del d["_rowid"]
+        page.append(d)
+    cursor = rows[-1]["_rowid"] if len(rows) == limit else None
+    return page, cursor
+
+
+def iter_tasks_local(
+    page_size: int = 500, columns: Optional[Sequence[str]] = None, where: str = "all"
+) -> Iterator[Dict]:
+    """Yield every task (most recent first), one page in memory at a time.
+
+    Each page is a separate short read, so no transaction stays open
+    between pages.
+    """
+    cursor = None
+    while True:
+        page, cursor = list_tasks_page(cursor, page_size, columns, where)
+        yield from page
+        if cursor is None:
+            return
+
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word, as a prefix, must match."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+@timed("db.search_tasks_local", rows=len)
+def search_tasks_local(query: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+    """Return tasks matching query, best matches first (bm25 rank)."""
+    match = _fts_query(query or "")
+    if not match:
+        return []
+    with transaction(immediate=False) as conn:
+        rows = conn.execute(
+            """
+            SELECT t.id, t.title, t.description, t.completed, t.synced
+            FROM tasks_fts f JOIN tasks t ON t.rowid = f.rowid
+            WHERE tasks_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ? OFFSET ?
+            """,
+            (match, limit, offset),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def task_counts() -> Dict[str, int]:
+    """Return total, open, completed and unsynced task counts (one row read)."""
+    with transaction(immediate=False) as conn:
+        total, completed, unsynced = conn.execute(
+            "SELECT total, completed, unsynced FROM task_counts WHERE id = 1"
+        ).fetchone()
+    return {
+        "total": total,
+        "open": total - completed,
+        "completed": completed,
+        "unsynced": unsynced,
+    }
+
+
+@timed("db.get_tasks_local", rows=len)
+def get_tasks_local(task_ids: Iterable[str], columns: Optional[Sequence[str]] = None) -> List[Dict]:
+    """Return the existing tasks among task_ids, in one query (any order)."""
+    select = _select_columns(columns)
+    with transaction(immediate=False) as conn:
+        rows = conn.execute(
+            f"SELECT {select} FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(task_ids)),),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+@timed("db.update_task_local", rows=lambda r: 1 if r else 0)
+def update_task_local(
+    task_id: str, title: str = None, description: str = None, completed: bool = None
+) -> Optional[Dict]:
+    """Change the given fields with one UPDATE; returns the updated row.
+
+    Returns None (and queues nothing) if the task does not exist.
+    """
+    # only fields that were passed, plus the unsynced mark
+    assignments = ["synced = 0", "updated_at = ?"]
+    params = [time.time()]
+    for column, value in (("title", title), ("description", description)):
+        if value is not None:
+            assignments.append(f"{column} = ?")
+            params.append(value)
     if completed is not None:
-        cur.execute("UPDATE tasks SET completed = ? WHERE id = ?", (1 if completed else 0, task_id))
-    # mark unsynced after update
-    cur.execute("UPDATE tasks SET synced = 0 WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
+        assignments.append("completed = ?")
+        params.append(1 if completed else 0)
 
+    with transaction() as conn:
+        row = conn.execute(
+            f"UPDATE tasks SET {', '.join(assignments)} WHERE id = ? "
+            f"RETURNING {', '.join(TASK_COLUMNS)}",
+            params + [task_id],
+        ).fetchone()
+        if row is None:
+            return None
+        _enqueue(conn, task_id, "upsert")
+        _record_change("update", task_id)
+    return dict(row)
+
+
+@timed("db.delete_task_local", rows=1)
 def delete_task_local(task_id: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        _enqueue(conn, task_id, "delete")
+        _record_change("delete", task_id)
 
-def mark_task_synced(task_id: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE tasks SET synced = 1 WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
 
-def update_task_local(task_id: str, title: str = None, description: str = None, completed: bool = None):
-    conn = get_connection()
-    cur = conn.cursor()
-    if title is not None:
-        cur.execute("UPDATE tasks SET title = ? WHERE id = ?", (title, task_id))
-    if description is not None:
-        cur.execute("UPDATE tasks SET description = ? WHERE id = ?", (description, task_id))
-    if completed is not None:
-        cur.execute("UPDATE tasks SET completed = ? WHERE id = ?", (1 if completed else 0, task_id))
-    # mark unsynced after update
-    cur.execute("UPDATE tasks SET synced = 0 WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
-def clear_all_tasks():
-    """Remove all tasks from local SQLite table."""
+@timed("db.complete_tasks_local", rows=lambda n: n)
+def complete_tasks_local(task_ids: Iterable[str], completed: bool = True) -> int:
+    """Set completed on many tasks in one transaction; returns rows changed.
+
+    Tasks already in that state are left alone (no server write queued).
+    """
+    flag = 1 if completed else 0
+    with transaction() as conn:
+        changed = [
+            r[0]
+            for r in conn.execute(
+                """
+                UPDATE tasks SET completed = ?, synced = 0, updated_at = ?
+                WHERE id IN (SELECT value FROM json_each(?)) AND completed != ?
+                RETURNING id
+                """,
+                (flag, time.time(), json.dumps(list(task_ids)), flag),
+            )
+        ]
+        conn.executemany(_ENQUEUE_SQL, [(i, "complete") for i in changed])
+        for task_id in changed:
+            _record_change("update", task_id)
+    return len(changed)
+
+
+@timed("db.delete_tasks_local", rows=lambda n: n)
+def delete_tasks_local(task_ids: Iterable[str]) -> int:
+    """Delete many tasks (active or archived) in one transaction; returns rows deleted."""
+    ids = list(task_ids)
+    with transaction() as conn:
+        if len(ids) >= BULK_INDEX_MIN_ROWS:
+            index = _bulk_search_index(conn, ids)
+        else:
+            index = nullcontext()
+        with index:
+            deleted = [
+                r[0]
+                for r in conn.execute(
+                    "DELETE FROM tasks WHERE id IN (SELECT value FROM json_each(?)) RETURNING id",
+                    (json.dumps(ids),),
+                )
+            ]
+        deleted += [
+            r[0]
+            for r in conn.execute(
+                "DELETE FROM archived_tasks WHERE id IN (SELECT value FROM json_each(?)) RETURNING id",
+                (json.dumps(ids),),
+            )
+        ]
+        conn.executemany(_ENQUEUE_SQL, [(i, "delete") for i in deleted])
+        for task_id in deleted:
+            _record_change("delete", task_id)
+    return len(deleted)
+
+
+def _server_time(value, default: float) -> float:
+    """Unix seconds of a server timestamptz (ISO 8601 text); default if absent."""
+    if not value:
+        return default
+    # fromisoformat before 3.11 takes neither "Z" nor 1-5 fraction digits
+    text = re.sub(r"\.(\d+)", lambda m: "." + m.group(1)[:6].ljust(6, "0"), value)
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return default
+
+
+def _server_row_params(t: Dict, now: float):
+    # updated_at is the server's last change, so archiving ages a task
+    # from its last edit (on any device), not from when it was downloaded
+    return (
+        t.get("id"),
+        t.get("title"),
+        t.get("description") or "",
+        1 if t.get("completed") else 0,
+        t.get("user_id"),
+        now,
+        _server_time(t.get("updated_at"), now),
+    )
+
+
+@timed("db.apply_remote_changes", rows=lambda n: n)
+def apply_remote_changes(tasks: List[Dict]) -> int:
+    """Upsert changed server rows and drop tombstoned ones, in one transaction.
+
+    Rows with a truthy "deleted" field are tombstones; rows with a truthy
+    "archived" field go to archived_tasks (and leave tasks). Tasks with a
+    pending outbox entry are left alone; the local edit wins until pushed.
+    Returns the number of rows applied.
+    """
+    now = time.time()
+    with transaction() as conn:
+        pending = {r[0] for r in conn.execute("SELECT task_id FROM outbox")}
+        tasks = [t for t in tasks if t.get("id") not in pending]
+        if len(tasks) >= BULK_INDEX_MIN_ROWS:
+            index = _bulk_search_index(conn, [t["id"] for t in tasks])
+        else:
+            index = nullcontext()
+        with index:
+            conn.executemany(
+                """
+                INSERT INTO tasks
+                  (id, title, description, completed, user_id, created_at, updated_at, synced)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT(id) DO UPDATE SET
+                  title = excluded.title,
+                  description = excluded.description,
+                  completed = excluded.completed,
+                  user_id = coalesce(excluded.user_id, tasks.user_id),
+                  updated_at = excluded.updated_at,
+                  synced = 1
+                """,
+                [
+                    _server_row_params(t, now)
+                    for t in tasks
+                    if not t.get("deleted") and not t.get("archived")
+                ],
+            )
+            conn.executemany(
+                "DELETE FROM tasks WHERE id = ?",
+                [(t["id"],) for t in tasks if t.get("deleted") or t.get("archived")],
+            )
+        conn.executemany(
+            """
+            INSERT INTO archived_tasks
+              (id, title, description, completed, user_id, created_at, updated_at, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+              title = excluded.title,
+              description = excluded.description,
+              completed = excluded.completed,
+              user_id = coalesce(excluded.user_id, archived_tasks.user_id),
+              updated_at = excluded.updated_at
+            """,
+            [
+                _server_row_params(t, now) + (now,)
+                for t in tasks
+                if t.get("archived") and not t.get("deleted")
+            ],
+        )
+        # deleted, or restored on another device
+        conn.executemany(
+            "DELETE FROM archived_tasks WHERE id = ?",
+            [(t["id"],) for t in tasks if t.get("deleted") or not t.get("archived")],
+        )
+        for t in tasks:
+            if t.get("deleted"):
+                op = "delete"
+            elif t.get("archived"):
+                op = "archive"
+            else:
+                op = "update"
+            _record_change(op, t["id"])
+    return len(tasks)
+
+
+# -------------------------------------------------
+# SNAPSHOT DOWNLOAD (full download in pages)
+# -------------------------------------------------
+# A full download arrives in pages, each applied in its own transaction so
+# the list can fill in progressively. Ids seen so far are collected in a
+# TEMP table; finish_snapshot() then drops local rows the server no longer
+# has. All three calls must run on the same thread (same connection).
+def begin_snapshot():
+    with transaction() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS snapshot_ids (id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.snapshot_ids")
+
+
+@timed("db.apply_snapshot_page", rows=lambda n: n)
+def apply_snapshot_page(tasks: List[Dict]) -> int:
+    """Apply one page of live server rows and remember their ids."""
+    with transaction() as conn:
+        n = apply_remote_changes(tasks)
+        conn.executemany(
+            "INSERT OR IGNORE INTO temp.snapshot_ids (id) VALUES (?)",
+            [(t["id"],) for t in tasks],
+        )
+    return n
+
+
+@timed("db.finish_snapshot", rows=lambda n: n)
+def finish_snapshot() -> int:
+    """Delete synced local rows missing from the snapshot; returns the count."""
+    with transaction() as conn:
+        gone = [
+            r[0]
+            for r in conn.execute(
+                """
+                SELECT id FROM tasks
+                WHERE id NOT IN (SELECT id FROM temp.snapshot_ids)
+                  AND id NOT IN (SELECT task_id FROM outbox)
+                """
+            )
+        ]
+        conn.executemany("DELETE FROM tasks WHERE id = ?", [(i,) for i in gone])
+        conn.execute("DROP TABLE temp.snapshot_ids")
+        for task_id in gone:
+            _record_change("delete", task_id)
+    return len(gone)
+
+
+# -------------------------------------------------
+# RECONCILIATION (per-bucket digests)
+# -------------------------------------------------
+# Tasks are grouped into buckets by the first DIGEST_PREFIX_LEN characters
+# of their id. A bucket's digest is the md5 of the md5s of its rows, in id
+# order; public.task_bucket_digests() in supabase_schema.sql computes the
+# same on the server, so matching buckets need no transfer.
+DIGEST_PREFIX_LEN = 2
+
+
+def _row_digest(task_id, title, description, completed) -> str:
+    text = f"{task_id}|{title}|{description or ''}|{1 if completed else 0}"
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+@timed("db.bucket_digests", rows=len)
+def bucket_digests(prefix_len: int = DIGEST_PREFIX_LEN) -> Dict[str, Tuple[int, str]]:
+    """Return {bucket prefix: (row count, digest)} for the local tasks."""
+    digests = {}
+    bucket, h, n = None, None, 0
+    with transaction(immediate=False) as conn:
+        # the primary key index yields rows in id order, no sort needed
+        for task_id, title, description, completed in conn.execute(
+            "SELECT id, title, description, completed FROM tasks ORDER BY id"
+        ):
+            prefix = task_id[:prefix_len]
+            if prefix != bucket:
+                if bucket is not None:
+                    digests[bucket] = (n, h.hexdigest())
+                bucket, h, n = prefix, hashlib.md5(), 0
+            h.update(_row_digest(task_id, title, description, completed).encode("ascii"))
+            n += 1
+    if bucket is not None:
+        digests[bucket] = (n, h.hexdigest())
+    return digests
+
+
+def bucket_bounds(prefix: str) -> Tuple[str, str]:
+    """Lowest and highest uuid (as text) in the bucket named by prefix.
+
+    For server queries, where id is a uuid column; local buckets are
+    matched on the id prefix itself (see replace_bucket).
+    """
+    pad = 8 - len(prefix)
+    return (
+        prefix + "0" * pad + "-0000-0000-0000-000000000000",
+        prefix + "f" * pad + "-ffff-ffff-ffff-ffffffffffff",
+    )
+
+
+@timed("db.replace_bucket", rows=lambda n: n)
+def replace_bucket(prefix: str, tasks: List[Dict]) -> int:
+    """Make one bucket match the server's live rows; returns rows deleted.
+
+    Like a full snapshot, but limited to ids in the bucket. Rows with
+    pending outbox entries keep their local state.
+    """
+    with transaction() as conn:
+        apply_remote_changes(tasks)
+        gone = [
+            r[0]
+            for r in conn.execute(
+                # the bucket as bucket_digests() defines it, so ids outside
+                # the uuid range (e.g. uppercase) cannot linger in it
+                """
+                SELECT id FROM tasks
+                WHERE substr(id, 1, ?) = ?
+                  AND id NOT IN (SELECT value FROM json_each(?))
+                  AND id NOT IN (SELECT task_id FROM outbox)
+                """,
+                (len(prefix), prefix, json.dumps([t["id"] for t in tasks])),
+            )
+        ]
+        conn.executemany("DELETE FROM tasks WHERE id = ?", [(i,) for i in gone])
+        for task_id in gone:
+            _record_change("delete", task_id)
+    return len(gone)
+
+
+# -------------------------------------------------
+# ARCHIVE (old completed tasks, loaded only by the Archive view)
+# -------------------------------------------------
+# Completed tasks unchanged for ARCHIVE_AFTER_DAYS (by updated_at: the
+# last local edit, or the server's for rows pulled down) move from tasks to
+# archived_tasks, so listings, counts, search and full downloads no
+# longer pay for them. The server keeps them with archived = true.
+# 0 (TODO_ARCHIVE_DAYS=0) turns archiving off.
+ARCHIVE_AFTER_DAYS = float(os.getenv("TODO_ARCHIVE_DAYS", "30"))
+# Tasks moved per transaction
+ARCHIVE_BATCH = 5000
+
+ARCHIVE_COLUMNS = (
+    "id", "title", "description", "completed",
+    "user_id", "created_at", "updated_at", "archived_at",
+)
+
+
+@timed("db.archive_completed", rows=lambda n: n)
+def archive_completed(older_than_days: float = None) -> int:
+    """Move completed tasks unchanged for older_than_days to the archive.
+
+    Works in ARCHIVE_BATCH-sized transactions, so writers never wait
+    long. Each task queues an "archive" server write and is reported
+    to change listeners as "archive". Returns the number moved.
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    if days <= 0:
+        return 0
+    now = time.time()
+    cutoff = now - days * 86400
+    moved = 0
+    while True:
+        with transaction() as conn:
+            ids = [
+                r[0]
+                for r in conn.execute(
+                    # without ANALYZE data the planner prefers tasks_status,
+                    # which walks every completed task
+                    "SELECT id FROM tasks INDEXED BY tasks_done_updated "
+                    "WHERE completed = 1 AND updated_at < ? LIMIT ?",
+                    (cutoff, ARCHIVE_BATCH),
+                )
+            ]
+            ids_json = json.dumps(ids)
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO archived_tasks
+                  (id, title, description, completed, user_id, created_at, updated_at, archived_at)
+                SELECT id, title, description, completed, user_id, created_at, updated_at, ?
+                FROM tasks WHERE id IN (SELECT value FROM json_each(?))
+                """,
+                (now, ids_json),
+            )
+            if len(ids) >= BULK_INDEX_MIN_ROWS:
+                index = _bulk_search_index(conn, ids)
+            else:
+                index = nullcontext()
+            with index:
+                conn.execute(
+                    "DELETE FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids_json,),
+                )
+            conn.executemany(_ENQUEUE_SQL, [(i, "archive") for i in ids])
+            for task_id in ids:
+                _record_change("archive", task_id)
+        moved += len(ids)
+        if len(ids) < ARCHIVE_BATCH:
+            return moved
+
+
+@timed("db.list_archived_page", rows=lambda r: len(r[0]))
+def list_archived_page(
+    after: Optional[int] = None, limit: int = 200, columns: Optional[Sequence[str]] = None
+) -> Tuple[List[Dict], Optional[int]]:
+    """One page of archived tasks, most recently archived first.
+
+    Same keyset cursor contract as list_tasks_page.
+    """
+    select = _select_columns(columns, ARCHIVE_COLUMNS)
+    with transaction(immediate=False) as conn:
+        if after is None:
+            rows = conn.execute(
+                f"SELECT rowid AS _rowid, {select} FROM archived_tasks "
+                "ORDER BY rowid DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                f"SELECT rowid AS _rowid, {select} FROM archived_tasks "
+                "WHERE rowid < ? ORDER BY rowid DESC LIMIT ?",
+                (after, limit),
+            ).fetchall()
+    page = []
+    for r in rows:
+        d = dict(r)
+        del d["_rowid"]
+        page.append(d)
+    cursor = rows[-1]["_rowid"] if len(rows) == limit else None
+    return page, cursor
+
+
+@timed("db.restore_archived", rows=lambda n: n)
+def restore_archived(task_ids: Iterable[str]) -> int:
+    """Move archived tasks back to tasks (still completed); returns the count.
+
+    Restored tasks count as just changed, so they are not archived again
+    for another ARCHIVE_AFTER_DAYS.
+    """
+    with transaction() as conn:
+        restored = [
+            r[0]
+            for r in conn.execute(
+                """
+                INSERT INTO tasks
+                  (id, title, description, completed, synced, user_id, created_at, updated_at)
+                SELECT id, title, description, completed, 0, user_id, created_at, ?
+                FROM archived_tasks WHERE id IN (SELECT value FROM json_each(?))
+                RETURNING id
+                """,
+                (time.time(), json.dumps(list(task_ids))),
+            )
+        ]
+        conn.execute(
+            "DELETE FROM archived_tasks WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(restored),),
+        )
+        # the upsert carries archived = false to the server
+        conn.executemany(_ENQUEUE_SQL, [(i, "upsert") for i in restored])
+        for task_id in restored:
+            _record_change("insert", task_id)
+    return len(restored)
+
+
+# -------------------------------------------------
+# MAINTENANCE (archiving + incremental vacuum)
+# -------------------------------------------------
+# Pages handed back to the file system per vacuum_step (4 KiB each)
+VACUUM_STEP_PAGES = 2048
+
+
+@timed("db.vacuum_step", rows=lambda n: n)
+def vacuum_step(max_pages: int = VACUUM_STEP_PAGES) -> int:
+    """Return up to max_pages free pages to the file system; returns pages freed.
+
+    A file created before auto_vacuum was turned on is converted with
+    one full VACUUM instead. Must not run inside transaction().
+    """
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM tasks")
-    conn.commit()
-    conn.close()
+    if _local.depth:
+        raise RuntimeError("vacuum_step() cannot run inside transaction()")
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        # the rebuilt file can come out a page or two bigger
+        return max(0, before - conn.execute("PRAGMA page_count").fetchone()[0])
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not free:
+        return 0
+    # execute() steps a no-column pragma once, freeing a single page;
+    # executescript() runs it to completion (in its own transaction)
+    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    return max(0, free - conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+
+def run_maintenance(archive_after_days: float = None) -> Dict[str, int]:
+    """Archive old completed tasks, then reclaim part of the free space."""
+    archived = archive_completed(archive_after_days)
+    return {"archived": archived, "vacuumed_pages": vacuum_step()}
+
+
+# -------------------------------------------------
+# SYNC STATE (per-user high-water mark)
+# -------------------------------------------------
+def get_sync_high_water(user_id: str):
+    """Return the newest server updated_at already applied, or None."""
+    with transaction(immediate=False) as conn:
+        row = conn.execute(
+            "SELECT high_water FROM sync_state WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def set_sync_high_water(user_id: str, high_water: str):
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO sync_state (user_id, high_water) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET high_water = excluded.high_water
+            """,
+            (user_id, high_water),
+        )
+
+
+# -------------------------------------------------
+# OUTBOX (pending server writes)
+# -------------------------------------------------
+OUTBOX_BACKOFF_BASE = 2.0   # seconds
+OUTBOX_BACKOFF_MAX = 300.0
+# Failed attempts before an entry is parked: no more retries until the
+# task is edited again (which requeues it); counted as "stuck" by outbox_counts()
+OUTBOX_MAX_ATTEMPTS = 10
+
+
+# ops: "upsert" sends the whole row, "complete" only the completed flag
+# and "archive" only the archived flag (each pushed as one filtered update
+# per batch), "delete" a tombstone. A pending upsert is never narrowed to
+# a complete or archive: the row may not exist on the server yet.
+_ENQUEUE_SQL = """
+INSERT INTO outbox (task_id, op) VALUES (?, ?)
+ON CONFLICT(task_id) DO UPDATE SET
+  op = CASE
+    WHEN excluded.op IN ('complete', 'archive') AND outbox.op = 'upsert' THEN 'upsert'
+    ELSE excluded.op
+  END,
+  version = outbox.version + 1,
+  attempts = 0,
+  next_attempt_at = 0,
+  last_error = NULL
+"""
+
+
+def _enqueue(conn, task_id: str, op: str):
+    """Queue a server write for task_id; replaces any older pending op."""
+    conn.execute(_ENQUEUE_SQL, (task_id, op))
+
+
+@timed("db.pending_outbox", rows=len)
+def pending_outbox(limit: int = 500) -> List[Dict]:
+    """Return due outbox entries, joined with the current task row.
+
+    Each entry has task_id, op, version, the task fields (None when the
+    row is gone) and archived (whether the row is in the archive).
+    """
+    with transaction(immediate=False) as conn:
+        rows = conn.execute(
+            """
+            SELECT o.task_id, o.op, o.version, o.attempts,
+                   coalesce(t.title, a.title) AS title,
+                   coalesce(t.description, a.description) AS description,
+                   coalesce(t.completed, a.completed) AS completed,
+                   a.id IS NOT NULL AS archived
+            FROM outbox o
+            LEFT JOIN tasks t ON t.id = o.task_id
+            LEFT JOIN archived_tasks a ON a.id = o.task_id
+            WHERE o.next_attempt_at <= ?
+            ORDER BY o.rowid
+            LIMIT ?
+            """,
+            (time.time(), limit),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+@timed("db.enqueue_unsynced", rows=lambda n: n)
+def enqueue_unsynced() -> int:
+    """Queue a push for unsynced rows that have no outbox entry.
+
+    Covers rows written before the outbox existed. Returns the count.
+    """
+    with transaction() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO outbox (task_id, op)
+            SELECT id, 'upsert' FROM tasks
+            WHERE synced = 0 AND id NOT IN (SELECT task_id FROM outbox)
+            """
+        )
+    return cur.rowcount
+
+
+def outbox_counts() -> Dict[str, int]:
+    """Return how many writes are queued, how many of them last failed and
+    how many are parked after OUTBOX_MAX_ATTEMPTS failures."""
+    with transaction(immediate=False) as conn:
+        pending, failed, stuck = conn.execute(
+            "SELECT count(*), count(last_error), total(attempts >= ?) FROM outbox",
+            (OUTBOX_MAX_ATTEMPTS,),
+        ).fetchone()
+    return {"pending": pending, "failed": failed, "stuck": int(stuck)}
+
+
+def next_outbox_attempt():
+    """Return the earliest next_attempt_at in the outbox, or None if empty."""
+    with transaction(immediate=False) as conn:
+        row = conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE attempts < ?",
+            (OUTBOX_MAX_ATTEMPTS,),
+        ).fetchone()
+    return row[0]
+
+
+@timed("db.ack_outbox")
+def ack_outbox(entries: List[Dict]):
+    """Drop pushed entries and mark their tasks synced.
+
+    Entries edited again while the push was in flight (newer version)
+    stay queued.
+    """
+    with transaction() as conn:
+        for e in entries:
+            cur = conn.execute(
+                "DELETE FROM outbox WHERE task_id = ? AND version = ?",
+                (e["task_id"], e["version"]),
+            )
+            if cur.rowcount and e["op"] != "delete":
+                cur = conn.execute(
+                    "UPDATE tasks SET synced = 1 WHERE id = ? AND synced = 0", (e["task_id"],)
+                )
+                if cur.rowcount:
+                    # the unsynced counter and views follow the flag
+                    _record_change("update", e["task_id"])
+
+
+@timed("db.fail_outbox")
+def fail_outbox(entries: List[Dict], error: str) -> List[str]:
+    """Record a failed push and schedule a retry with exponential backoff.
+
+    Returns the task ids parked after OUTBOX_MAX_ATTEMPTS failures.
+    """
+    now = time.time()
+    parked = []
+    with transaction() as conn:
+        for e in entries:
+            if e["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                next_attempt = float("inf")
+                parked.append(e["task_id"])
+            else:
+                next_attempt = now + min(
+                    OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** e["attempts"]
+                )
+            conn.execute(
+                """
+                UPDATE outbox
+                SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                WHERE task_id = ? AND version = ?
+                """,
+                (next_attempt, error, e["task_id"], e["version"]),
+            )
+    return parked
+
+
+# -------------------------------------------------
+# BULK IMPORT / EXPORT
+# -------------------------------------------------
+IMPORT_CHUNK_SIZE = 20000
+EXPORT_FETCH_SIZE = 1000
+
+
+def _truthy(value) -> int:
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ("1", "true", "yes", "y") else 0
+    return 1 if value else 0
+
+
+def _import_params(record: Dict, synced: bool):
+    title = record.get("title")
+    if not title:
+        raise ValueError(f"Task without a title: {record!r}")
+    task_id = record.get("id")
+    if task_id:
+        # the server's id column is a uuid: one bad id fails a whole push batch
+        try:
+            task_id = str(uuid.UUID(str(task_id)))
+        except ValueError:
+            raise ValueError(f"Task id is not a UUID: {record!r}") from None
+    return (
+        task_id or str(uuid.uuid4()),
+        title,
+        record.get("description") or "",
+        _truthy(record.get("completed")),
+        1 if synced else 0,
+        time.time(),
+    )
+
+
+@timed("db.import_tasks", rows=lambda n: n)
+def import_tasks(
+    records: Iterable[Dict], synced: bool = False, chunk_size: int = IMPORT_CHUNK_SIZE
+) -> int:
+    """Insert or overwrite tasks from an iterable of dicts; returns the count.
+
+    Records are consumed lazily and written with executemany, one
+    transaction per chunk. Unless synced=True, every imported task is
+    queued in the outbox so the sync worker pushes it to the server.
+    An id must be a UUID (stored in canonical lowercase form); records
+    without one get a new id. A bad record raises ValueError.
+    """
+    total = 0
+    chunk = []
+    for record in records:
+        chunk.append(_import_params(record, synced))
+        if len(chunk) >= chunk_size:
+            total += _import_chunk(chunk, synced)
+            chunk = []
+    if chunk:
+        total += _import_chunk(chunk, synced)
+    return total
+
+
+def _import_chunk(params, synced: bool) -> int:
+    with transaction() as conn, _bulk_search_index(conn, [p[0] for p in params]):
+        conn.executemany(
+            """
+            INSERT INTO tasks (id, title, description, completed, synced, created_at, updated_at)
+            VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?6)
+            ON CONFLICT(id) DO UPDATE SET
+              title = excluded.title,
+              description = excluded.description,
+              completed = excluded.completed,
+              synced = excluded.synced,
+              updated_at = excluded.updated_at
+            """,
+            params,
+        )
+        if not synced:
+            conn.executemany(_ENQUEUE_SQL, [(p[0], "upsert") for p in params])
+        # too many rows to patch one by one
+        _record_change("reset")
+    return len(params)
+
+
+def read_ndjson(f: TextIO) -> Iterator[Dict]:
+    """Yield one task dict per non-empty line of newline-delimited JSON."""
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(f: TextIO) -> Iterator[Dict]:
+    """Yield task dicts from CSV with a header row (id is optional)."""
+    yield from csv.DictReader(f)
+
+
+@timed("db.export_tasks", rows=lambda n: n)
+def export_tasks(f: TextIO, fmt: str = "ndjson", columns: Optional[Sequence[str]] = None) -> int:
+    """Write every task to f as "ndjson" or "csv"; returns the row count.
+
+    Rows are streamed from one cursor (a consistent snapshot) in
+    batches of EXPORT_FETCH_SIZE, so memory use does not grow with the table.
+    """
+    if fmt not in ("ndjson", "csv"):
+        raise ValueError(f"Unknown export format: {fmt}")
+    columns = tuple(columns or TASK_COLUMNS)
+    select = _select_columns(columns)
+
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(columns)
+
+    total = 0
+    with transaction(immediate=False) as conn:
+        cur = conn.execute(f"SELECT {select} FROM tasks ORDER BY rowid")
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(tuple(r) for r in rows)
+            else:
+                f.writelines(json.dumps(dict(r), ensure_ascii=False) + "\n" for r in rows)
+            total += len(rows)
+    return total
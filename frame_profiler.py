@@ -0,0 +1,204 @@
+"""Frame-time profiler for the Kivy UI.
+
+Times every frame of the Kivy Clock and flags frames slower than
+TODO_SLOW_FRAME_MS (default 25 ms, a frame and a half at 60 fps). A
+slow frame is attributed to the stats-timed calls and spans (see
+stats.timed / stats.span) that ran on the UI thread during it, e.g.
+ui.apply_changes, ui.refresh_tasks or ui.dialog.edit; time no call
+accounts for is reported as "other" (layout, drawing, input).
+
+Toggle at runtime with F12 (or enable()); TODO_FRAME_PROFILE=1 starts
+it on. Turning it off writes the recorded frames and calls as a Chrome
+trace (chrome://tracing, ui.perfetto.dev) to TODO_FRAME_TRACE. While
+off nothing is scheduled and timed calls cost their usual flag checks.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import stats
+
+PROFILE = os.getenv("TODO_FRAME_PROFILE") == "1"
+SLOW_FRAME_MS = float(os.getenv("TODO_SLOW_FRAME_MS", "25"))
+TRACE_PATH = os.getenv("TODO_FRAME_TRACE", "frame_trace.json")
+# Trace events kept for dump_trace (frames and calls, all threads)
+TRACE_EVENTS = 100_000
+# Slow frames listed in the console at most this often per second
+SLOW_REPORTS_PER_SEC = 4
+TOGGLE_KEY = 293  # F12
+
+_enabled = False
+_ui_thread = None
+_frame_event = None
+_frame_start = None
+_frame_calls = []  # (name, start, seconds) on the UI thread this frame
+_trace = deque(maxlen=TRACE_EVENTS)  # (name, start, seconds, thread id)
+_thread_names = {}
+_slow = deque(maxlen=100)  # (start, seconds, cause) of recent slow frames
+_frames = 0
+_last_report = 0.0
+
+
+def enabled():
+    return _enabled
+
+
+def install(window=None, enable_now=PROFILE):
+    """Bind the toggle key; call once on the UI thread, after the window exists."""
+    global _ui_thread
+    _ui_thread = threading.get_ident()
+    _thread_names[_ui_thread] = threading.current_thread().name
+    if window is not None:
+        window.bind(on_keyboard=_on_keyboard)
+    if enable_now:
+        enable()
+
+
+def enable(flag=True):
+    """Start (or stop) profiling; stopping writes the trace file."""
+    global _enabled, _frame_event, _frame_start
+    from kivy.clock import Clock
+
+    if flag == _enabled:
+        return
+    _enabled = flag
+    if flag:
+        if _ui_thread is None:
+            install()
+        _frame_start = None
+        _frame_calls.clear()
+        stats.add_observer(_observe)
+        # once per frame, after the callbacks scheduled for it
+        _frame_event = Clock.schedule_interval(_on_frame, 0)
+        print(f"frame profiler: on (slow frame > {SLOW_FRAME_MS:.0f} ms)")
+    else:
+        stats.remove_observer(_observe)
+        if _frame_event is not None:
+            _frame_event.cancel()
+            _frame_event = None
+        print("frame profiler: off;", summary())
+        if _trace:
+            try:
+                dump_trace()
+            except OSError as e:
+                print("frame profiler: trace error:", e)
+
+
+def toggle():
+    enable(not _enabled)
+
+
+def _on_keyboard(window, key, *args):
+    if key == TOGGLE_KEY:
+        toggle()
+        return True
+    return False
+
+
+# -------------------------------------------------
+# RECORDING
+# -------------------------------------------------
+def _observe(name, start, seconds):
+    tid = threading.get_ident()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
+    _trace.append((name, start, seconds, tid))
+    if tid == _ui_thread:
+        _frame_calls.append((name, start, seconds))
+
+
+def _on_frame(dt):
+    global _frame_start, _frames
+    now = time.perf_counter()
+    start, _frame_start = _frame_start, now
+    calls = _frame_calls[:]
+    _frame_calls.clear()
+    if start is None:
+        return
+    seconds = now - start
+    _frames += 1
+    _trace.append(("frame", start, seconds, _ui_thread))
+    if stats.enabled():
+        stats.record("ui.frame", seconds)
+    if seconds * 1000 > SLOW_FRAME_MS:
+        _report_slow(start, seconds, calls)
+
+
+def _outermost(calls):
+    """Calls not nested inside another call, longest first."""
+    top, end = [], float("-inf")
+    for name, start, seconds in sorted(calls, key=lambda c: (c[1], -c[2])):
+        if start >= end:
+            top.append((name, seconds))
+            end = start + seconds
+    top.sort(key=lambda c: -c[1])
+    return top
+
+
+def _report_slow(start, seconds, calls):
+    global _last_report
+    top = _outermost(calls)
+    cause = top[0][0] if top and top[0][1] >= seconds / 4 else "other"
+    _slow.append((start, seconds, cause))
+    if stats.enabled():
+        stats.record("ui.frame.slow", seconds)
+    now = time.perf_counter()
+    if now - _last_report < 1 / SLOW_REPORTS_PER_SEC:
+        return
+    _last_report = now
+    other = seconds - sum(s for _, s in top)
+    parts = [f"{name} {s * 1000:.1f}" for name, s in top[:3]]
+    parts.append(f"other {max(other, 0) * 1000:.1f}")
+    print(f"slow frame {seconds * 1000:.1f} ms: " + ", ".join(parts))
+
+
+# -------------------------------------------------
+# OUTPUT
+# -------------------------------------------------
+def slow_frames():
+    """Recent slow frames as (seconds, cause), oldest first."""
+    return [(seconds, cause) for _, seconds, cause in _slow]
+
+
+def summary():
+    causes = {}
+    for _, seconds, cause in _slow:
+        causes[cause] = causes.get(cause, 0) + 1
+    worst = sorted(causes.items(), key=lambda c: -c[1])[:3]
+    text = f"{_frames} frames, {len(_slow)} slow"
+    if worst:
+        text += " (" + ", ".join(f"{name} x{n}" for name, n in worst) + ")"
+    return text
+
+
+def dump_trace(path=None):
+    """Write the recorded frames and calls as Chrome trace JSON; returns the path."""
+    path = path or TRACE_PATH
+    pid = os.getpid()
+    slow = {start for start, _, _ in _slow}
+    events = [
+        {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+        for tid, name in list(_thread_names.items())
+    ]
+    for name, start, seconds, tid in list(_trace):
+        event = {
+            "name": name,
+            "cat": "frame" if name == "frame" else name.split(".", 1)[0],
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": seconds * 1e6,
+            "pid": pid,
+            "tid": tid,
+        }
+        if name == "frame" and start in slow:
+            event["name"] = "slow frame"
+            event["args"] = {"ms": round(seconds * 1000, 2)}
+        events.append(event)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    os.replace(tmp, path)
+    print(f"frame profiler: wrote {len(events)} trace events to {path}")
+    return path
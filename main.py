@@ -1,33 +1,87 @@
 # C:\Users\angad\OneDrive\Desktop\todo_python_app\main.py
+import time
+
+# taken before the heavy imports so time-to-first-frame includes them
+_PROCESS_START = time.perf_counter()
+
 from kivymd.app import MDApp
+from kivy.clock import Clock
+from kivy.core.window import Window
 from kivy.uix.screenmanager import ScreenManager
 from screens.login import LoginScreen
-from screens.todo_list import TodoListScreen
-from database import create_tables
+from database import create_tables, flush_writes
+import stats
+import frame_profiler
 import traceback
 import sys
+import os
 
 
 class WindowManager(ScreenManager):
-    pass
+    """ScreenManager that can build screens the first time they are used."""
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self._factories = {}
+
+    def add_lazy_screen(self, name, factory):
+        """Register factory(name=...) to build screen `name` on first use."""
+        self._factories[name] = factory
+
+    def has_screen(self, name):
+        return name in self._factories or super().has_screen(name)
+
+    def get_screen(self, name):
+        factory = self._factories.pop(name, None)
+        if factory is not None:
+            self.add_widget(factory(name=name))
+        return super().get_screen(name)
+
+
+def _build_todo_screen(**kw):
+    # imported here: the list screen pulls in the sync engine and more widgets
+    from screens.todo_list import TodoListScreen
+
+    return TodoListScreen(**kw)
 
 
 class TodoApp(MDApp):
     def build(self):
         create_tables()
+        if stats.enabled():
+            stats.start_periodic_export()
 
         # app theme
-        self.theme_cls.theme_style = "Light"          
-        self.theme_cls.primary_palette = "Blue"       
+        self.theme_cls.theme_style = "Light"
+        self.theme_cls.primary_palette = "Blue"
         self.theme_cls.primary_hue = "500"
 
-        # screen manager
+        # screen manager; the todo screen (and its data) loads when first shown
         self.sm = WindowManager()
         self.sm.add_widget(LoginScreen(name="login"))
-        self.sm.add_widget(TodoListScreen(name="todo"))
+        self.sm.add_lazy_screen("todo", _build_todo_screen)
         self.sm.current = "login"
         return self.sm
 
+    def on_start(self):
+        # F12 toggles it; TODO_FRAME_PROFILE=1 profiles from the start
+        frame_profiler.install(Window)
+        Clock.schedule_once(self._on_first_frame, 0)
+
+    def on_stop(self):
+        # writes still waiting for the end of the frame
+        flush_writes()
+        if frame_profiler.enabled():
+            frame_profiler.enable(False)
+
+    def _on_first_frame(self, dt):
+        elapsed = time.perf_counter() - _PROCESS_START
+        stats.record("app.time_to_first_frame", elapsed)
+        print(f"startup: first frame after {elapsed * 1000:.0f} ms")
+        # TODO_MEASURE_STARTUP=1 python main.py: measure and exit
+        if os.getenv("TODO_MEASURE_STARTUP") == "1":
+            self.stop()
+
 
 if __name__ == "__main__":
     try:
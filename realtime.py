@@ -0,0 +1,115 @@
+"""Change feeds that push server row changes to the sync engine.
+
+A feed is opened on the sync engine's event loop with
+``await feed.open(get_client, user_id, emit)`` and reports through
+emit(kind, value), which is safe to call from any thread:
+
+    emit("status", "connected")     subscribed; the engine runs a catch-up pull
+    emit("status", "disconnected")  dropped; the engine reopens with backoff
+    emit("change", row)             one changed row (tombstones have deleted=True)
+
+SupabaseChangeFeed listens to Postgres changes on public.tasks for the
+user. LocalChangeFeed is an in-process stand-in for tests and offline
+demos. Set TODO_REALTIME=0 to fall back to manual refresh.
+"""
+import os
+
+REALTIME = os.getenv("TODO_REALTIME", "1") == "1"
+
+
+def row_from_payload(payload):
+    """Turn a postgres_changes payload into a row for apply_remote_changes."""
+    data = payload.get("data", payload) if isinstance(payload, dict) else {}
+    kind = data.get("type") or data.get("eventType")
+    if kind == "DELETE":
+        old = data.get("old_record") or data.get("old") or {}
+        return {"id": old.get("id"), "deleted": True} if old.get("id") else None
+    record = data.get("record") or data.get("new") or {}
+    return record if record.get("id") else None
+
+
+class SupabaseChangeFeed:
+    """Supabase Realtime subscription to the user's rows in public.tasks.
+
+    The table must be in the supabase_realtime publication (see
+    supabase_schema.sql). RLS applies, using the session the engine's
+    client is signed in with.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._channel = None
+
+    async def open(self, get_client, user_id, emit):
+        self._client = await get_client()
+
+        def on_change(payload):
+            row = row_from_payload(payload)
+            if row is not None:
+                emit("change", row)
+
+        def on_status(status, err=None):
+            state = getattr(status, "value", status)
+            if state == "SUBSCRIBED":
+                emit("status", "connected")
+            elif state in ("CHANNEL_ERROR", "TIMED_OUT", "CLOSED"):
+                if err:
+                    print("Realtime error:", err)
+                emit("status", "disconnected")
+
+        channel = self._client.channel(f"tasks:{user_id}")
+        channel.on_postgres_changes(
+            "*",
+            schema="public",
+            table="tasks",
+            filter=f"user_id=eq.{user_id}",
+            callback=on_change,
+        )
+        self._channel = channel
+        await channel.subscribe(on_status)
+
+    async def close(self):
+        channel, self._channel = self._channel, None
+        if channel is not None:
+            try:
+                await self._client.remove_channel(channel)
+            except Exception as e:
+                print("Realtime close error:", e)
+
+
+class LocalChangeFeed:
+    """In-process change feed with the same contract, for offline use.
+
+    Another thread (a test, a fake second device) calls publish() with
+    server-shaped rows, and disconnect() to simulate a dropped socket.
+    Every open() reports "connected" straight away.
+    """
+
+    def __init__(self):
+        self._emit = None
+        self._user_id = None
+        self.opened = 0
+
+    async def open(self, get_client, user_id, emit):
+        self._user_id = user_id
+        self._emit = emit
+        self.opened += 1
+        emit("status", "connected")
+
+    async def close(self):
+        self._emit = None
+
+    def publish(self, row):
+        """Deliver one row, unless it belongs to another user."""
+        emit = self._emit
+        if emit is None:
+            return False
+        if row.get("user_id") not in (None, self._user_id):
+            return False
+        emit("change", row)
+        return True
+
+    def disconnect(self):
+        emit = self._emit
+        if emit is not None:
+            emit("status", "disconnected")
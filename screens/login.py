@@ -6,8 +6,8 @@ from kivymd.uix.boxlayout import MDBoxLayout
 from kivy.metrics import dp
 from kivy.clock import Clock
 
-from database import clear_all_tasks
-from supabase_client import supabase
+from database import use_user_store
+from supabase_client import get_client, sign_in
 
 
 class LoginScreen(MDScreen):
@@ -59,18 +59,17 @@ class LoginScreen(MDScreen):
             return
 
         try:
-            # Sign in with Supabase
-            supabase.auth.sign_in_with_password(
-                {"email": email, "password": password}
-            )
+            # Sign in with Supabase (caches the user for the sync code)
+            user = sign_in(email, password)
 
-            # 1) Clear local tasks from previous user
-            clear_all_tasks()
+            # 1) Open this user's own local store (kept across logins)
+            use_user_store(user["id"] if user else None)
 
             # 2) Go to todo screen
             self.manager.current = "todo"
 
-            # 3) After screen switch, trigger full sync for THIS user
+            # 3) After screen switch, catch up with the server (a delta pull
+            #    if this account has synced on this device before)
             todo_screen = self.manager.get_screen("todo")
             Clock.schedule_once(lambda dt: todo_screen.on_sync())
 
@@ -128,7 +127,7 @@ class LoginScreen(MDScreen):
             return
 
         try:
-            supabase.auth.sign_up({"email": email, "password": password})
+            get_client().auth.sign_up({"email": email, "password": password})
             dialog.dismiss()
             MDDialog(text="Account created! Now login with these details.").open()
         except Exception as e:
@@ -0,0 +1,22 @@
+"""Maps tasks (dicts or task_store rows) to RecycleView data rows.
+
+Kept free of Kivy imports so the mapping can be timed headless.
+"""
+from typing import Dict, Iterable, List
+
+
+def task_to_row(task: Dict) -> Dict:
+    """Return the RecycleView data dict for one task."""
+    return {
+        "task_id": task["id"],
+        "text": task.get("title") or "Untitled",
+        "secondary_text": task.get("description") or "",
+        "completed": bool(task.get("completed")),
+        # set by the screen in multi-select mode; always present so a
+        # recycled view never keeps a previous row's state
+        "selected": False,
+    }
+
+
+def tasks_to_rows(tasks: Iterable[Dict]) -> List[Dict]:
+    return [task_to_row(t) for t in tasks]
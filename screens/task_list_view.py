@@ -0,0 +1,62 @@
+from kivymd.uix.list import TwoLineAvatarIconListItem, IconLeftWidget
+
+from kivy.metrics import dp
+from kivy.properties import BooleanProperty, StringProperty
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+
+
+class TaskListItem(RecycleDataViewBehavior, TwoLineAvatarIconListItem):
+    """One recycled row; RecycleView re-binds it to different tasks."""
+
+    task_id = StringProperty("")
+    completed = BooleanProperty(False)
+    selected = BooleanProperty(False)
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self._icon = IconLeftWidget(icon="blank")
+        self.add_widget(self._icon)
+        self.rv = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.rv = rv
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_completed(self, instance, value):
+        self._update_icon()
+
+    def on_selected(self, instance, value):
+        self._update_icon()
+
+    def _update_icon(self):
+        if self.selected:
+            self._icon.icon = "checkbox-marked-circle"
+        else:
+            self._icon.icon = "check" if self.completed else "blank"
+
+    def on_release(self):
+        if self.rv is not None and self.rv.on_task_click:
+            self.rv.on_task_click(self.task_id)
+
+
+class TaskRecycleView(RecycleView):
+    """Virtualized task list: only the visible rows exist as widgets.
+
+    Fill it with ``data = tasks_to_rows(...)``.
+    """
+
+    def __init__(self, on_task_click=None, **kw):
+        super().__init__(**kw)
+        self.on_task_click = on_task_click
+        self.viewclass = TaskListItem
+
+        layout = RecycleBoxLayout(
+            orientation="vertical",
+            default_size=(None, dp(72)),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+        )
+        layout.bind(minimum_height=layout.setter("height"))
+        self.add_widget(layout)
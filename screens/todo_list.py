@@ -2,25 +2,67 @@ from kivymd.uix.screen import MDScreen
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.dialog import MDDialog
 from kivymd.uix.textfield import MDTextField
-from kivymd.uix.list import MDList, TwoLineAvatarIconListItem, IconLeftWidget
 from kivymd.uix.button import MDRaisedButton, MDFlatButton, MDIconButton
 from kivymd.uix.label import MDLabel
 from kivymd.uix.floatlayout import MDFloatLayout
+from kivymd.uix.progressbar import MDProgressBar
 
 from kivy.clock import Clock
 from kivy.metrics import dp
-from kivy.uix.scrollview import ScrollView
 
 from database import (
-    list_tasks_local,
-    add_task_local,
-    delete_task_local,
-    update_task_local,
-    get_connection,
+    iter_tasks_local,
+    list_archived_page,
+    search_tasks_local,
+    task_counts,
+    use_user_store,
+    set_write_scheduler,
 )
-from supabase_client import supabase, get_current_user
+from supabase_client import sign_out
+from sync_engine import sync_engine
+from task_store import task_store
+from realtime import REALTIME, SupabaseChangeFeed
+from screens.task_adapter import task_to_row, tasks_to_rows
+import stats
+from screens.task_list_view import TaskRecycleView
 
-import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Above this many changed rows a full reload is cheaper than patching
+# (a page of a full download, see sync_engine.PULL_PAGE_SIZE, is patched)
+PATCH_LIMIT = 5000
+
+# Filter tabs: name -> (label, task_counts key, test for one task)
+FILTERS = {
+    "all": ("All", "total", None),
+    "open": ("Open", "open", lambda t: not t["completed"]),
+    "done": ("Done", "completed", lambda t: t["completed"]),
+    "unsynced": ("Unsynced", "unsynced", lambda t: not t["synced"]),
+}
+
+# The Archive tab shows archived_tasks, a page at a time as it scrolls
+ARCHIVE = "archive"
+ARCHIVE_PAGE_SIZE = 200
+
+# Task fields the list rows need (filtered views are read from SQLite)
+VIEW_COLUMNS = ("id", "title", "description", "completed")
+
+# Wait this long after the last keystroke before searching
+SEARCH_DEBOUNCE = 0.25
+SEARCH_LIMIT = 200
+
+# one background thread for search queries, so typing never piles them up
+_search_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _push_when_committed(future):
+    """Wake the outbox drain once a task_store write is committed.
+
+    Writes wait for the end-of-frame group commit; notifying earlier
+    would find no outbox entry and leave the push for the idle timer.
+    """
+    future.add_done_callback(lambda f: sync_engine.notify())
 
 
 class TodoListScreen(MDScreen):
@@ -57,6 +99,16 @@ class TodoListScreen(MDScreen):
 
         top_bar.add_widget(lbl_title)
         top_bar.add_widget(spacer_top)
+        if stats.enabled():
+            top_bar.add_widget(
+                MDIconButton(icon="chart-bar", on_release=self.show_stats)
+            )
+        top_bar.add_widget(
+            MDIconButton(
+                icon="checkbox-multiple-marked-outline",
+                on_release=self.toggle_select_mode,
+            )
+        )
         top_bar.add_widget(btn_refresh)
         root.add_widget(top_bar)
 
@@ -68,10 +120,46 @@ class TodoListScreen(MDScreen):
             pos_hint={"top": 0.9},
         )
 
-        scroll = ScrollView()
-        self.task_list = MDList()
-        scroll.add_widget(self.task_list)
-        center_box.add_widget(scroll)
+        # filter tabs; their labels double as the open / done summary
+        filter_bar = MDBoxLayout(
+            orientation="horizontal",
+            spacing=dp(4),
+            size_hint_y=None,
+            height=dp(40),
+        )
+        self._filter = "all"
+        self.filter_buttons = {}
+        for name, (label, _, _) in FILTERS.items():
+            btn = MDFlatButton(
+                text=label, on_release=lambda btn, name=name: self.set_filter(name)
+            )
+            self.filter_buttons[name] = btn
+            filter_bar.add_widget(btn)
+        # no count: archived tasks are not loaded until the tab is opened
+        btn = MDFlatButton(text="Archive", on_release=lambda btn: self.set_filter(ARCHIVE))
+        self.filter_buttons[ARCHIVE] = btn
+        filter_bar.add_widget(btn)
+        center_box.add_widget(filter_bar)
+        self._archive_cursor = None
+        self._archive_fetched = False
+
+        self.search_field = MDTextField(
+            hint_text="Search tasks",
+            size_hint_y=None,
+            height=dp(48),
+        )
+        self.search_field.bind(text=self.on_search_text)
+        center_box.add_widget(self.search_field)
+
+        # shown only while a full download is running
+        self.sync_progress = MDProgressBar(
+            value=0, size_hint_y=None, height=dp(4), opacity=0
+        )
+        center_box.add_widget(self.sync_progress)
+
+        self.task_list = TaskRecycleView(on_task_click=self.on_item_click)
+        self.task_list.bind(scroll_y=self._on_list_scroll)
+        center_box.add_widget(self.task_list)
         root.add_widget(center_box)
 
         # -------- BOTTOM BAR (Add left, Logout right) ------------
@@ -100,40 +188,256 @@ class TodoListScreen(MDScreen):
         bottom_bar.add_widget(spacer_bottom) # middle (flex)
         bottom_bar.add_widget(btn_logout)    # right
         root.add_widget(bottom_bar)
+        self.root_layout = root
+        self.bottom_bar = bottom_bar
 
-        # Load tasks from local DB
+        # -------- SELECTION BAR (replaces the bottom bar) --------
+        self.select_bar = MDBoxLayout(
+            orientation="horizontal",
+            padding=[dp(12), 0, dp(12), dp(12)],
+            spacing=dp(8),
+            size_hint=(1, None),
+            height=dp(52),
+            pos_hint={"y": 0},
+        )
+        self.select_label = MDLabel(text="0 selected")
+        self.select_bar.add_widget(self.select_label)
+        self.select_bar.add_widget(
+            MDFlatButton(text="ALL", on_release=self.select_all)
+        )
+        self.select_bar.add_widget(
+            MDRaisedButton(text="DONE", on_release=self.complete_selected)
+        )
+        self.select_bar.add_widget(
+            MDRaisedButton(text="DELETE", on_release=self.delete_selected)
+        )
+        self.select_bar.add_widget(
+            MDFlatButton(text="CANCEL", on_release=self.toggle_select_mode)
+        )
+        self._selecting = False
+        self._selected = set()
+
+        # Load tasks from the in-memory store, then patch rows as it changes
+        self._rows_by_id = {}
+        self._pending_changes = deque()
+        self._patch_trigger = Clock.create_trigger(self._apply_changes)
+        self._search_query = ""
+        self._search_seq = 0
+        self._search_event = Clock.create_trigger(self._run_search, SEARCH_DEBOUNCE)
+        task_store.add_listener(self._on_db_change)
         self.refresh_tasks()
 
+        # Server sync runs on its own event loop; results come back on
+        # the Kivy main thread
+        sync_engine.set_dispatcher(lambda fn: Clock.schedule_once(lambda dt: fn()))
+
+        # writes made during one frame are committed together before the
+        # next one (one transaction, one fsync)
+        set_write_scheduler(lambda flush: Clock.schedule_once(lambda dt: flush(), -1))
+        sync_engine.start()
+
     # -------------------------------------------------
     # LIST + DISPLAY
     # -------------------------------------------------
     def refresh_tasks(self):
-        """Reload tasks from local DB into the list widget."""
-        self.task_list.clear_widgets()
-        tasks = list_tasks_local()
-
-        for t in tasks:
-            title = t.get("title", "Untitled")
-            desc = t.get("description") or ""
-
-            if t.get("completed"):
-                item = TwoLineAvatarIconListItem(
-                    text=title,
-                    secondary_text=desc,
-                )
-                item.add_widget(IconLeftWidget(icon="check"))
+        """Rebuild the list widget for the current filter.
+
+        "All" comes from the in-memory task store; the other filters are
+        index-backed queries. The archive shows its first page.
+        """
+        with stats.span("ui.refresh_tasks") as s:
+            if self._filter == ARCHIVE:
+                rows = self._archive_page()
+            elif self._filter == "all":
+                rows = tasks_to_rows(task_store.rows())
             else:
-                item = TwoLineAvatarIconListItem(
-                    text=title,
-                    secondary_text=desc,
+                rows = tasks_to_rows(
+                    iter_tasks_local(columns=VIEW_COLUMNS, where=self._filter)
                 )
+            self._show_rows(rows)
+            s["rows"] = len(rows)
+        self._update_counts()
+
+    @stats.timed("ui.set_filter")
+    def set_filter(self, name):
+        self._filter = name
+        # search covers active tasks only
+        self.search_field.disabled = name == ARCHIVE
+        if name == ARCHIVE and not self._archive_fetched:
+            # tasks archived on the server before our first download
+            self._archive_fetched = True
+            sync_engine.pull_archive()
+        if name == ARCHIVE and self._search_query:
+            # clearing the field refreshes the list
+            self.search_field.text = ""
+        elif self._search_query:
+            self._run_search()
+        else:
+            self.refresh_tasks()
+
+    def _update_counts(self):
+        """Refresh the tab labels from the trigger-maintained counters."""
+        counts = task_counts()
+        for name, (label, key, _) in FILTERS.items():
+            btn = self.filter_buttons[name]
+            btn.text = f"{label} {counts[key]}"
+            btn.opacity = 1 if name == self._filter else 0.6
+        self.filter_buttons[ARCHIVE].opacity = 1 if self._filter == ARCHIVE else 0.6
+
+    def _on_db_change(self, changes):
+        # may be called from a sync thread; patch on the next frame
+        self._pending_changes.extend(changes)
+        self._patch_trigger()
+
+    @stats.timed("ui.apply_changes")
+    def _apply_changes(self, *args):
+        """Patch only the changed rows instead of rebuilding the list."""
+        changes = []
+        while self._pending_changes:
+            changes.append(self._pending_changes.popleft())
+        if not changes:
+            return
+        self._update_counts()
+        if self._search_query:
+            # rows shown are search hits; re-run the search instead
+            self._run_search()
+            return
+        if self._filter == ARCHIVE:
+            if any(op in ("archive", "reset") or task_id in self._rows_by_id
+                   for op, task_id in changes):
+                self.refresh_tasks()
+            return
+        if len(changes) > PATCH_LIMIT or any(op == "reset" for op, _ in changes):
+            self.refresh_tasks()
+            return
+
+        with stats.span("ui.patch_rows") as s:
+            s["rows"] = len(changes)
+            self._patch_rows(changes)
+
+    def _patch_rows(self, changes):
+        """Apply row changes with a single assignment to the view data."""
+        match = FILTERS[self._filter][2]
+        inserted, removed, updated = [], set(), False
+        for op, task_id in changes:
+            row = self._rows_by_id.get(task_id)
+            task = None if op == "delete" else task_store.get(task_id)
+            if task is not None and match is not None and not match(task):
+                # no longer (or not yet) part of the filtered view
+                task = None
+
+            if task is None:
+                if row is not None:
+                    removed.add(task_id)
+                    del self._rows_by_id[task_id]
+            elif row is None:
+                row = task_to_row(task)
+                self._rows_by_id[task_id] = row
+                inserted.append(row)
+            else:
+                row.update(task_to_row(task), selected=task_id in self._selected)
+                updated = True
+
+        data = self.task_list.data
+        if removed:
+            inserted = [r for r in inserted if r["task_id"] not in removed]
+            data = [r for r in data if r["task_id"] not in removed]
+        if inserted:
+            # newest first, matching the order of iter_tasks_local
+            data = inserted[::-1] + list(data)
+        if removed or inserted:
+            self.task_list.data = data
+        elif updated:
+            self.task_list.refresh_from_data()
+
+    # -------------------------------------------------
+    # ARCHIVE (loaded lazily, one page at a time)
+    # -------------------------------------------------
+    def _archive_page(self, after=None):
+        page, self._archive_cursor = list_archived_page(
+            after, ARCHIVE_PAGE_SIZE, columns=VIEW_COLUMNS
+        )
+        return tasks_to_rows(page)
+
+    def _on_list_scroll(self, view, scroll_y):
+        # scroll_y reaches 0 at the bottom; load the next page near it
+        if self._filter != ARCHIVE or self._archive_cursor is None or scroll_y > 0.05:
+            return
+        with stats.span("ui.archive_page") as s:
+            rows = self._archive_page(self._archive_cursor)
+            for r in rows:
+                r["selected"] = r["task_id"] in self._selected
+                self._rows_by_id[r["task_id"]] = r
+            self.task_list.data = self.task_list.data + rows
+            s["rows"] = len(rows)
+
+    @stats.timed("ui.dialog.archived")
+    def _archived_item_options(self, task_id):
+        dialog = MDDialog(
+            title="Archived task",
+            text="Move this task back to your list?",
+            buttons=[
+                MDFlatButton(
+                    text="RESTORE",
+                    on_release=lambda btn: (
+                        dialog.dismiss(),
+                        self.restore_task(task_id),
+                    ),
+                ),
+                MDFlatButton(text="CLOSE", on_release=lambda btn: dialog.dismiss()),
+            ],
+        )
+        dialog.open()
 
-            item.bind(on_release=lambda inst, tid=t["id"]: self.on_item_click(tid))
-            self.task_list.add_widget(item)
+    def restore_task(self, task_id):
+        _push_when_committed(task_store.restore([task_id]))
+
+    # -------------------------------------------------
+    # SEARCH
+    # -------------------------------------------------
+    def on_search_text(self, instance, text):
+        self._search_query = (text or "").strip()
+        # restart the debounce window on every keystroke
+        self._search_event.cancel()
+        if self._search_query:
+            self._search_event()
+        else:
+            self.refresh_tasks()
+
+    def _run_search(self, *args):
+        self._search_seq += 1
+        seq, query = self._search_seq, self._search_query
+        future = _search_executor.submit(search_tasks_local, query, SEARCH_LIMIT)
+        future.add_done_callback(
+            lambda f: Clock.schedule_once(lambda dt: self._show_search_results(seq, f))
+        )
+
+    @stats.timed("ui.show_search_results")
+    def _show_search_results(self, seq, future):
+        # drop results of queries the user has already typed past
+        if seq != self._search_seq or not self._search_query:
+            return
+        try:
+            tasks = future.result()
+        except Exception as e:
+            print("Search error:", e)
+            return
+        match = FILTERS[self._filter][2]
+        if match is not None:
+            tasks = [t for t in tasks if match(t)]
+        self._show_rows(tasks_to_rows(tasks))
+
+    def _show_rows(self, rows):
+        if self._selected:
+            for r in rows:
+                r["selected"] = r["task_id"] in self._selected
+        self._rows_by_id = {r["task_id"]: r for r in rows}
+        self.task_list.data = rows
 
     # -------------------------------------------------
     # ADD + SAVE
     # -------------------------------------------------
+    @stats.timed("ui.dialog.add")
     def add_task(self, *args):
         """Open dialog with Title + Description fields."""
         title_field = MDTextField(
@@ -188,36 +492,19 @@ class TodoListScreen(MDScreen):
             MDDialog(text="Please enter a task title").open()
             return
 
-        task_id = add_task_local(title, description)
-        self.refresh_tasks()
-
-        # Sync in background
-        threading.Thread(
-            target=self.sync_task, args=(task_id, title, description), daemon=True
-        ).start()
-
-    def sync_task(self, task_id, title, description):
-        try:
-            user = get_current_user()
-            if not user or not user.get("id"):
-                print("No user found during sync_task; skipping server insert.")
-                return
-
-            supabase.table("tasks").insert(
-                {
-                    "id": task_id,
-                    "title": title,
-                    "description": description,
-                    "user_id": user["id"],
-                }
-            ).execute()
-        except Exception as e:
-            print("Sync failed:", e)
+        _push_when_committed(task_store.add(title, description))
 
     # -------------------------------------------------
     # TAP ON TASK: EDIT / DONE / DELETE
     # -------------------------------------------------
+    @stats.timed("ui.dialog.item")
     def on_item_click(self, task_id):
+        if self._selecting:
+            self._toggle_selected(task_id)
+            return
+        if self._filter == ARCHIVE:
+            self._archived_item_options(task_id)
+            return
         dialog = MDDialog(
             title="Task options",
             text="Choose an action for this task",
@@ -248,23 +535,17 @@ class TodoListScreen(MDScreen):
         )
         dialog.open()
 
+    @stats.timed("ui.dialog.edit")
     def edit_task(self, task_id):
         """Open dialog to edit existing task."""
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT title, description FROM tasks WHERE id = ?",
-            (task_id,),
-        )
-        row = cur.fetchone()
-        conn.close()
+        task = task_store.get(task_id)
 
-        if not row:
+        if not task:
             MDDialog(text="Task not found.").open()
             return
 
-        current_title = row[0] or ""
-        current_desc = row[1] or ""
+        current_title = task["title"] or ""
+        current_desc = task["description"] or ""
 
         title_field = MDTextField(
             hint_text="Task title",
@@ -315,116 +596,111 @@ class TodoListScreen(MDScreen):
             MDDialog(text="Title cannot be empty").open()
             return
 
-        update_task_local(task_id, title=new_title, description=new_desc)
-        self.refresh_tasks()
-
-        threading.Thread(
-            target=self.sync_update_server,
-            args=(task_id, new_title, new_desc),
-            daemon=True,
-        ).start()
-
-    def sync_update_server(self, task_id, title, description):
-        try:
-            user = get_current_user()
-            if not user or not user.get("id"):
-                return
-            supabase.table("tasks").update(
-                {"title": title, "description": description}
-            ).eq("id", task_id).eq("user_id", user["id"]).execute()
-        except Exception as e:
-            print("Sync update error:", e)
+        _push_when_committed(
+            task_store.update(task_id, title=new_title, description=new_desc)
+        )
 
     def delete_task(self, task_id):
-        delete_task_local(task_id)
-        self.refresh_tasks()
-        threading.Thread(
-            target=self._delete_server, args=(task_id,), daemon=True
-        ).start()
-
-    def _delete_server(self, task_id):
-        try:
-            user = get_current_user()
-            if not user or not user.get("id"):
-                return
-            supabase.table("tasks").delete().eq("id", task_id).eq(
-                "user_id", user["id"]
-            ).execute()
-        except Exception as e:
-            print("Server delete error:", e)
+        _push_when_committed(task_store.delete(task_id))
 
     def complete_task(self, task_id):
-        update_task_local(task_id, completed=True)
-        self.refresh_tasks()
-        threading.Thread(
-            target=self.sync_complete_server, args=(task_id,), daemon=True
-        ).start()
+        _push_when_committed(task_store.complete_many([task_id]))
 
-    def sync_complete_server(self, task_id):
-        try:
-            user = get_current_user()
-            if not user or not user.get("id"):
-                return
-            supabase.table("tasks").update({"completed": True}).eq("id", task_id).eq(
-                "user_id", user["id"]
-            ).execute()
-        except Exception as e:
-            print("Sync complete error:", e)
+    # -------------------------------------------------
+    # MULTI-SELECT: one transaction and one request per action
+    # -------------------------------------------------
+    def toggle_select_mode(self, *args):
+        self._selecting = not self._selecting
+        if self._selecting:
+            self.root_layout.remove_widget(self.bottom_bar)
+            self.root_layout.add_widget(self.select_bar)
+        else:
+            self.root_layout.remove_widget(self.select_bar)
+            self.root_layout.add_widget(self.bottom_bar)
+            self._set_selection(set())
+
+    def _toggle_selected(self, task_id):
+        self._set_selection(self._selected ^ {task_id})
+
+    def select_all(self, *args):
+        """Select every row shown (the whole list or the search hits)."""
+        self._set_selection(set(self._rows_by_id))
+
+    @stats.timed("ui.set_selection")
+    def _set_selection(self, selected):
+        for task_id in self._selected ^ selected:
+            row = self._rows_by_id.get(task_id)
+            if row is not None:
+                row["selected"] = task_id in selected
+        self._selected = selected
+        self.select_label.text = f"{len(selected)} selected"
+        self.task_list.refresh_from_data()
+
+    def complete_selected(self, *args):
+        if self._selected:
+            _push_when_committed(task_store.complete_many(self._selected))
+        self.toggle_select_mode()
+
+    def delete_selected(self, *args):
+        if self._selected:
+            _push_when_committed(task_store.delete_many(self._selected))
+        self.toggle_select_mode()
 
     # -------------------------------------------------
     # SYNC ALL FROM SERVER
     # -------------------------------------------------
+    def on_enter(self, *args):
+        # other devices' changes stream in while signed in; the feed
+        # stops with sync_engine.cancel_all() on logout
+        if REALTIME:
+            sync_engine.listen(SupabaseChangeFeed())
+
     def on_sync(self, *args):
-        threading.Thread(target=self.full_sync, daemon=True).start()
+        sync_engine.notify()
+        # compare bucket digests; only buckets that differ are downloaded
+        sync_engine.reconcile(
+            on_done=self._on_sync_done, on_progress=self._on_sync_progress
+        )
 
-    def full_sync(self):
-        try:
-            user = get_current_user()
-            if not user or not user.get("id"):
-                print("No user found during full_sync; skipping server fetch.")
-                return
-
-            res = supabase.table("tasks").select("*").eq(
-                "user_id", user["id"]
-            ).execute()
-            server_tasks = (
-                res.get("data", [])
-                if isinstance(res, dict)
-                else getattr(res, "data", []) or []
-            )
+    @stats.timed("ui.sync_progress")
+    def _on_sync_progress(self, received, total):
+        """A page of a full download was committed."""
+        bar = self.sync_progress
+        bar.opacity = 1
+        bar.max = max(total or 0, received, 1)
+        bar.value = received
 
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("DELETE FROM tasks")
-            for t in server_tasks:
-                cur.execute(
-                    """
-                    INSERT INTO tasks (id, title, description, completed, synced)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (
-                        t.get("id"),
-                        t.get("title"),
-                        t.get("description") or "",
-                        1 if t.get("completed") else 0,
-                        1,
-                    ),
-                )
-            conn.commit()
-            conn.close()
+    @stats.timed("ui.sync_done")
+    def _on_sync_done(self, result):
+        self.sync_progress.opacity = 0
+        if isinstance(result, BaseException):
+            print("Sync error:", result)
 
-            Clock.schedule_once(lambda dt: self.refresh_tasks())
-        except Exception as e:
-            print("Full sync error:", e)
+    # -------------------------------------------------
+    # STATS
+    # -------------------------------------------------
+    def show_stats(self, *args):
+        """Show the hot-path timers (only wired up when stats are enabled)."""
+        MDDialog(
+            title="Performance stats",
+            text=stats.format_table(),
+        ).open()
 
     # -------------------------------------------------
     # LOGOUT
     # -------------------------------------------------
     def logout(self, *args):
+        # drop in-flight requests for this user; queued writes stay in the outbox
+        sync_engine.cancel_all()
         try:
-            supabase.auth.sign_out()
+            sign_out()
         except Exception as e:
             print("sign_out error:", e)
             MDDialog(text=f"Logout error: {e}").open()
             return
+        if self._selecting:
+            self.toggle_select_mode()
+        self._archive_fetched = False
+        # leave this user's file as is for next time
+        use_user_store(None)
         self.manager.current = "login"
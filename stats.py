@@ -0,0 +1,208 @@
+"""Opt-in timers and counters for the app's hot paths.
+
+Enable with TODO_STATS=1 (or stats.enable() at runtime). When disabled
+and nothing observes calls, a wrapped call costs two flag checks. Set
+TODO_STATS_EXPORT to a file path to also write a JSON snapshot every
+TODO_STATS_INTERVAL seconds.
+"""
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open-ended
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_enabled = os.getenv("TODO_STATS") == "1"
+_lock = threading.Lock()
+_metrics = {}
+_observers = []
+
+
+class _Metric:
+    __slots__ = ("calls", "errors", "rows", "total", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def percentile_ms(self, q):
+        """Bucket upper bound below which q percent of calls fall."""
+        target = self.calls * q / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                bound = BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf")
+                return min(bound, self.max * 1000)
+        return 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.calls if self.calls else 0.0,
+            "max_ms": self.max * 1000,
+            "p50_ms": self.percentile_ms(50),
+            "p99_ms": self.percentile_ms(99),
+            "histogram": dict(zip([str(b) for b in BUCKETS_MS] + ["inf"], self.buckets)),
+        }
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+
+def add_observer(fn):
+    """Call fn(name, start, seconds) after every timed call and span.
+
+    Observers run on the calling thread, whether or not stats are
+    enabled; start is a time.perf_counter() value.
+    """
+    _observers.append(fn)
+
+
+def remove_observer(fn):
+    if fn in _observers:
+        _observers.remove(fn)
+
+
+def _finish(name, start, rows=0, error=False):
+    seconds = time.perf_counter() - start
+    if _enabled:
+        record(name, seconds, rows, error)
+    for fn in list(_observers):
+        fn(name, start, seconds)
+
+
+def record(name, seconds, rows=0, error=False):
+    """Add one observation for name."""
+    with _lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = _metrics[name] = _Metric()
+        m.calls += 1
+        m.rows += rows
+        m.total += seconds
+        if seconds > m.max:
+            m.max = seconds
+        if error:
+            m.errors += 1
+        m.buckets[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+
+def timed(name, rows=None):
+    """Decorator timing every call of a function under name.
+
+    rows: optional callable mapping the return value to rows touched
+    (e.g. len), or an int counted per call.
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            if not _enabled and not _observers:
+                return fn(*args, **kw)
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kw)
+            except BaseException:
+                _finish(name, start, error=True)
+                raise
+            n = rows(result) if callable(rows) else (rows or 0)
+            _finish(name, start, n)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def span(name):
+    """Time a block; set ``info["rows"]`` inside it to count rows touched."""
+    if not _enabled and not _observers:
+        yield {}
+        return
+    info = {"rows": 0}
+    start = time.perf_counter()
+    try:
+        yield info
+    except BaseException:
+        _finish(name, start, info["rows"], error=True)
+        raise
+    _finish(name, start, info["rows"])
+
+
+# -------------------------------------------------
+# OUTPUT
+# -------------------------------------------------
+def snapshot():
+    """Return all metrics as a plain dict (safe to json.dump)."""
+    with _lock:
+        return {name: m.as_dict() for name, m in sorted(_metrics.items())}
+
+
+def format_table():
+    """Human-readable summary, one metric per line."""
+    lines = [f"{'metric':<32}{'calls':>8}{'err':>5}{'rows':>9}{'p50ms':>9}{'p99ms':>9}{'maxms':>9}"]
+    for name, m in snapshot().items():
+        lines.append(
+            f"{name:<32}{m['calls']:>8}{m['errors']:>5}{m['rows']:>9}"
+            f"{m['p50_ms']:>9.2f}{m['p99_ms']:>9.2f}{m['max_ms']:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+def dump_json(path):
+    data = {"time": time.time(), "metrics": snapshot()}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def start_periodic_export(path=None, interval=None):
+    """Write snapshots to path every interval seconds on a daemon thread.
+
+    Defaults come from TODO_STATS_EXPORT / TODO_STATS_INTERVAL. Returns
+    the thread, or None when there is nothing to export to.
+    """
+    path = path or os.getenv("TODO_STATS_EXPORT")
+    interval = float(interval or os.getenv("TODO_STATS_INTERVAL", "60"))
+    if not path:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            if not _enabled:
+                continue
+            try:
+                dump_json(path)
+                print(f"stats: wrote {len(_metrics)} metrics to {path}")
+            except OSError as e:
+                print("stats export error:", e)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
@@ -1,27 +1,69 @@
-from supabase import create_client
-from dotenv import load_dotenv
 import os
+import threading
+import time
 
-load_dotenv()
+from stats import timed
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# The supabase package is slow to import and create_client() builds HTTP
+# clients, so both happen on first use instead of at app start.
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+def _settings():
+    from dotenv import load_dotenv
 
-def get_current_user():
+    load_dotenv()
+    return os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")
+
+
+def get_client():
+    """Return the shared Supabase client, creating it on first call."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from supabase import create_client
+
+                _client = create_client(*_settings())
+    return _client
+
+
+async def get_async_client():
+    """Return the asyncio Supabase client used by the sync engine.
+
+    Only call this from the sync engine's event loop. The client is
+    signed in separately; see get_session_tokens().
     """
-    Safely get the current user as a dict with at least an 'id' key.
+    global _async_client
+    if _async_client is None:
+        from supabase import acreate_client
+
+        _async_client = await acreate_client(*_settings())
+    return _async_client
+
+
+def __getattr__(name):
+    # keeps `supabase_client.supabase` working for old callers
+    if name == "supabase":
+        return get_client()
+    raise AttributeError(name)
+
+# Re-validate the cached user this many seconds before the token expires
+TOKEN_REFRESH_MARGIN = 60
+
+_user_lock = threading.Lock()
+_cached_user = None
+_cached_expires_at = 0.0
+_cached_tokens = None
+
+
+def _extract_user(resp):
+    """
+    Pull the user out of an auth response as a dict with at least an 'id'.
     Works for both dict-style and object-style supabase responses.
-    Returns None if no logged-in user.
     """
-    try:
-        resp = supabase.auth.get_user()
-    except Exception as e:
-        print("get_user error:", e)
-        return None
-
     if not resp:
         return None
 
@@ -53,3 +95,95 @@ def get_current_user():
     user_id = getattr(user, "id", None)
     email = getattr(user, "email", None)
     return {"id": user_id, "email": email}
+
+
+def _set_cached_user(user, expires_at, tokens=None):
+    global _cached_user, _cached_expires_at, _cached_tokens
+    with _user_lock:
+        _cached_user = user
+        _cached_expires_at = expires_at
+        if tokens or user is None:
+            _cached_tokens = tokens
+
+
+def _cache_session(resp):
+    """Remember the user, tokens and expiry from a sign-in/session response."""
+    session = getattr(resp, "session", None) or resp
+    expires_at = getattr(session, "expires_at", None)
+    access = getattr(session, "access_token", None)
+    refresh = getattr(session, "refresh_token", None)
+    user = _extract_user(resp)
+    _set_cached_user(
+        user,
+        float(expires_at) if expires_at else time.time() + 3600,
+        (access, refresh) if access else None,
+    )
+    return user
+
+
+def clear_user_cache():
+    _set_cached_user(None, 0.0)
+
+
+def get_session_tokens():
+    """Return (access_token, refresh_token) of the signed-in user, or None.
+
+    Lets another client (the async one) act as the same user.
+    """
+    get_current_user()  # refreshes the session when it is close to expiry
+    with _user_lock:
+        return _cached_tokens
+
+
+@timed("supabase.sign_in")
+def sign_in(email, password):
+    """Sign in with email/password and cache the user. Raises on failure."""
+    resp = get_client().auth.sign_in_with_password({"email": email, "password": password})
+    return _cache_session(resp)
+
+
+def sign_out():
+    """Sign out and drop the cached user (even if the request fails)."""
+    try:
+        get_client().auth.sign_out()
+    finally:
+        clear_user_cache()
+
+
+@timed("supabase.get_current_user")
+def get_current_user():
+    """
+    Return the current user as a dict with at least an 'id' key, or None.
+
+    Served from the cache while the access token is valid. Near expiry the
+    session is refreshed (one round trip) and the cache filled again.
+    """
+    with _user_lock:
+        if _cached_user and time.time() < _cached_expires_at - TOKEN_REFRESH_MARGIN:
+            return _cached_user
+
+    try:
+        # get_session() refreshes an expired access token if needed
+        session = get_client().auth.get_session()
+        if session is None and _cached_user:
+            session = get_client().auth.refresh_session()
+    except Exception as e:
+        print("get_session error:", e)
+        session = None
+
+    if session is not None and getattr(session, "user", None) is not None:
+        return _cache_session(session)
+
+    try:
+        resp = get_client().auth.get_user()
+    except Exception as e:
+        print("get_user error:", e)
+        return None
+
+    user = _extract_user(resp)
+    if user is None:
+        clear_user_cache()
+        return None
+    # no expiry known on this path; re-check again after a short while
+    _set_cached_user(user, time.time() + 5 * TOKEN_REFRESH_MARGIN)
+    return user
@@ -0,0 +1,72 @@
+-- Server-side schema the app expects in Supabase (run in the SQL editor).
+
+create table if not exists public.tasks (
+  id uuid primary key,
+  user_id uuid not null references auth.users (id),
+  title text not null,
+  description text default '',
+  completed boolean not null default false,
+  -- soft delete: deleted rows stay as tombstones for delta sync
+  deleted boolean not null default false,
+  updated_at timestamptz not null default now()
+);
+
+-- archive tier: old completed tasks the app no longer downloads by
+-- default (fetched only for the Archive view)
+alter table public.tasks add column if not exists archived boolean not null default false;
+
+-- delta sync: "rows for this user changed since X"
+create index if not exists tasks_user_updated_idx
+  on public.tasks (user_id, updated_at);
+
+-- the Archive view's download, in id pages
+create index if not exists tasks_user_archived_idx
+  on public.tasks (user_id, id) where archived and not deleted;
+
+create or replace function public.tasks_touch_updated_at()
+returns trigger language plpgsql as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists tasks_touch_updated_at on public.tasks;
+create trigger tasks_touch_updated_at
+  before insert or update on public.tasks
+  for each row execute function public.tasks_touch_updated_at();
+
+alter table public.tasks enable row level security;
+
+drop policy if exists "own tasks" on public.tasks;
+create policy "own tasks" on public.tasks
+  for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
+
+-- realtime: stream row changes to signed-in devices (RLS still applies)
+do $$
+begin
+  alter publication supabase_realtime add table public.tasks;
+exception when duplicate_object then null;
+end;
+$$;
+
+-- reconciliation: per id-prefix bucket, the live unarchived row count, an
+-- md5 over those rows' md5s in id order, and the newest change (tombstones
+-- and archived rows included).
+-- Must match database.bucket_digests() in the app.
+create or replace function public.task_bucket_digests(prefix_len int default 2)
+returns table (bucket text, rows bigint, digest text, newest timestamptz)
+language sql stable security invoker as $$
+  select
+    left(id::text, prefix_len) as bucket,
+    count(*) filter (where not deleted and not archived) as rows,
+    md5(string_agg(
+      md5(id::text || '|' || title || '|' || coalesce(description, '') || '|' || completed::int::text),
+      '' order by id::text
+    ) filter (where not deleted and not archived)) as digest,
+    max(updated_at) as newest
+  from public.tasks
+  where user_id = auth.uid()
+  group by 1
+  order by 1;
+$$;
@@ -0,0 +1,688 @@
+"""Server sync on one dedicated asyncio event loop thread.
+
+All Supabase traffic (outbox pushes and pulls) runs as coroutines on
+this loop, using the async Supabase client. Its HTTP/2 connection pool
+lets concurrent requests share one connection. A semaphore caps how many
+requests are in flight. Results reach the UI only through the dispatcher
+set with set_dispatcher() (the Kivy main thread in the app).
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from database import (
+    transaction,
+    apply_remote_changes,
+    begin_snapshot,
+    apply_snapshot_page,
+    finish_snapshot,
+    DIGEST_PREFIX_LEN,
+    bucket_digests,
+    bucket_bounds,
+    replace_bucket,
+    get_sync_high_water,
+    set_sync_high_water,
+    pending_outbox,
+    next_outbox_attempt,
+    ack_outbox,
+    fail_outbox,
+    OUTBOX_MAX_ATTEMPTS,
+    run_maintenance,
+    close_connection,
+)
+from supabase_client import get_async_client, get_current_user, get_session_tokens
+from stats import span
+
+
+# Rows per page of a full download, and the only columns we store locally
+PULL_PAGE_SIZE = 1000
+PULL_COLUMNS = "id,user_id,title,description,completed,deleted,archived,updated_at"
+
+# Housekeeping (database.run_maintenance: archiving, incremental vacuum)
+# first runs this long after start, then every MAINTENANCE_INTERVAL
+MAINTENANCE_DELAY = 60.0
+MAINTENANCE_INTERVAL = 6 * 3600.0
+
+# Ids per filtered update (id=in.(...) in the URL): 200 uuids keep the
+# request line under about 8 KB, a common proxy limit
+FILTER_IDS_PER_REQUEST = 200
+
+# Backoff between attempts to reopen a dropped realtime feed (seconds)
+REALTIME_RETRY_MIN = 1.0
+REALTIME_RETRY_MAX = 60.0
+
+
+def _rejected(error):
+    """True if the server answered the request with an error (postgrest's
+    APIError carries a code), False if it never got through."""
+    return getattr(error, "code", None) is not None
+
+
+def _response_data(res):
+    return (
+        res.get("data", [])
+        if isinstance(res, dict)
+        else getattr(res, "data", []) or []
+    )
+
+
+class SyncEngine:
+    """Owns the sync event loop thread and everything that runs on it.
+
+    The outbox drain loop wakes on notify() or when a retry is due. Pending
+    edits to one task are already coalesced in the outbox, so each batch
+    becomes one bulk upsert plus a few filtered updates. Batches go out
+    concurrently up to max_concurrency. Failed entries stay queued and are
+    retried with backoff, up to OUTBOX_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, max_concurrency=4, batch_size=500, idle_interval=30.0):
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self._dispatch = lambda fn: fn()
+        self._loop = None
+        self._thread = None
+        self._wake = None
+        self._limit = None
+        self._pull_lock = None
+        self._drain_lock = None
+        self._drainer = None
+        self._maintainer = None
+        self._jobs = set()
+        self._futures = set()
+        self._session_tokens = None
+        self._listener = None
+        self._started = threading.Event()
+
+    # -------------------------------------------------
+    # LIFECYCLE (any thread)
+    # -------------------------------------------------
+    def set_dispatcher(self, dispatch):
+        """dispatch(fn) must run fn on the UI thread, e.g. via Clock."""
+        self._dispatch = dispatch
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        """Cancel all work and shut the loop thread down."""
+        loop = self._loop
+        if loop is None:
+            return
+        self.cancel_all()
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+
+    def notify(self):
+        """Wake the outbox drain after a local write."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def cancel_all(self):
+        """Cancel in-flight requests (e.g. on logout); the outbox is kept."""
+        # submitted jobs may not have started on the loop yet
+        for future in list(self._futures):
+            future.cancel()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._cancel_jobs)
+
+    def pull(self, full=False, on_done=None, on_progress=None):
+        """Schedule a pull; callbacks run via the dispatcher.
+
+        on_done(rows_or_exception) when finished; on_progress(received,
+        total) after each page of a full download.
+        """
+        return self.submit(self._pull(full, on_progress), on_done)
+
+    def listen(self, feed, on_status=None):
+        """Apply server changes from a realtime feed as they arrive.
+
+        Keeps the feed open (reopening it with backoff) until cancel_all()
+        or stop(); a second call while listening is a no-op. on_status
+        gets "connected" / "disconnected" via the dispatcher.
+        """
+        if self._listener is not None and not self._listener.done():
+            return self._listener
+        self._listener = self.submit(self._listen(feed, on_status))
+        return self._listener
+
+    def reconcile(self, on_done=None, on_progress=None):
+        """Schedule a digest comparison that downloads only differing buckets.
+
+        on_done gets the number of rows received (0 when already in sync).
+        """
+        return self.submit(self._reconcile(on_progress), on_done)
+
+    def pull_archive(self, on_done=None):
+        """Schedule a download of the archived rows (for the Archive view).
+
+        Regular pulls skip archived rows; on_done gets the number received.
+        """
+        return self.submit(self._pull_archive(), on_done)
+
+    def push_now(self, on_done=None):
+        """Drain the outbox right away; on_done gets the number pushed."""
+        return self.submit(self._drain(), on_done)
+
+    def submit(self, coro, on_done=None):
+        """Run coro on the sync loop; returns a concurrent.futures.Future."""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._track(coro), self._loop)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        if on_done is not None:
+            future.add_done_callback(lambda f: self._deliver(on_done, f))
+        return future
+
+    def _deliver(self, on_done, future):
+        if future.cancelled():
+            result = concurrent.futures.CancelledError()
+        else:
+            result = future.exception() or future.result()
+        self._dispatch(lambda: on_done(result))
+
+    # -------------------------------------------------
+    # LOOP THREAD
+    # -------------------------------------------------
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._wake = asyncio.Event()
+        self._limit = asyncio.Semaphore(self.max_concurrency)
+        self._pull_lock = asyncio.Lock()
+        self._drain_lock = asyncio.Lock()
+        self._drainer = loop.create_task(self._drain_forever())
+        self._maintainer = loop.create_task(self._maintain_forever())
+        self._loop = loop
+        loop.call_soon(self._started.set)
+        try:
+            loop.run_forever()
+        finally:
+            self._loop = None
+            self._drainer.cancel()
+            self._maintainer.cancel()
+            loop.run_until_complete(
+                asyncio.gather(
+                    self._drainer, self._maintainer, *self._jobs, return_exceptions=True
+                )
+            )
+            loop.close()
+            close_connection()
+
+    async def _track(self, coro):
+        """Run coro as a cancellable job (see cancel_all)."""
+        task = asyncio.current_task()
+        self._jobs.add(task)
+        try:
+            return await coro
+        finally:
+            self._jobs.discard(task)
+
+    def _cancel_jobs(self):
+        for task in list(self._jobs):
+            task.cancel()
+        self._session_tokens = None
+
+    async def _drain_forever(self):
+        while True:
+            self._wake.clear()
+            job = asyncio.ensure_future(self._track(self._drain()))
+            try:
+                await asyncio.wait({job})
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+            if not job.cancelled() and job.exception():
+                print("Sync engine error:", job.exception())
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._next_wait())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _maintain_forever(self):
+        await asyncio.sleep(MAINTENANCE_DELAY)
+        while True:
+            try:
+                # off the loop: a first-time VACUUM can take a while
+                result = await asyncio.to_thread(run_maintenance)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Maintenance error:", e)
+            else:
+                if result["archived"]:
+                    # push the archived flags
+                    self._wake.set()
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+    def _next_wait(self):
+        due = next_outbox_attempt()
+        if due is None:
+            return self.idle_interval
+        return min(self.idle_interval, max(0.0, due - time.time()))
+
+    async def _client(self):
+        """The async client, signed in as the current user."""
+        client = await get_async_client()
+        tokens = await asyncio.to_thread(get_session_tokens)
+        if tokens and tokens != self._session_tokens:
+            await client.auth.set_session(*tokens)
+            self._session_tokens = tokens
+        return client
+
+    async def _user_id(self):
+        user = await asyncio.to_thread(get_current_user)
+        return user.get("id") if user else None
+
+    async def _request(self, name, rows, query):
+        """Execute one query under the concurrency limit."""
+        async with self._limit:
+            with span(name) as s:
+                s["rows"] = rows
+                return await query.execute()
+
+    # -------------------------------------------------
+    # PUSH (local -> server)
+    # -------------------------------------------------
+    async def _drain(self):
+        """Push every due outbox entry; returns the number pushed."""
+        user_id = await self._user_id()
+        if not user_id:
+            # not logged in yet: keep everything queued
+            return 0
+
+        pushed = 0
+        # one drain at a time (the drain loop vs. push_now), or both would
+        # send the same entries
+        async with self._drain_lock:
+            while True:
+                # load as many batches as may run at once, then push them together
+                entries = pending_outbox(self.batch_size * self.max_concurrency)
+                if not entries:
+                    return pushed
+                batches = [
+                    entries[i:i + self.batch_size]
+                    for i in range(0, len(entries), self.batch_size)
+                ]
+                results = await asyncio.gather(
+                    *(self._push_batch(b, user_id) for b in batches)
+                )
+                pushed += sum(acked for acked, _ in results)
+                if any(failed for _, failed in results):
+                    # entries failed and were rescheduled; retry after their backoff
+                    return pushed
+
+    async def _push_batch(self, entries, user_id):
+        """Push one batch; returns (entries acknowledged, entries failed).
+
+        A batch the server rejects is split in half and each half pushed
+        again, so a bad entry (invalid row, policy violation) fails alone
+        instead of holding back the rest. Network errors fail the batch.
+        """
+        try:
+            await self._push(entries, user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if len(entries) > 1 and _rejected(e):
+                half = len(entries) // 2
+                results = await asyncio.gather(
+                    self._push_batch(entries[:half], user_id),
+                    self._push_batch(entries[half:], user_id),
+                )
+                return tuple(sum(r) for r in zip(*results))
+            print("Sync push failed:", e)
+            for task_id in fail_outbox(entries, str(e)):
+                print(f"Sync push gave up on task {task_id} after {OUTBOX_MAX_ATTEMPTS} attempts")
+            return 0, len(entries)
+        ack_outbox(entries)
+        return len(entries), 0
+
+    async def _push(self, entries, user_id):
+        """Send one batch as one upsert plus filtered updates for deletes,
+        archives and completed flags (done / not done), at most
+        FILTER_IDS_PER_REQUEST ids per update."""
+        upserts = [
+            {
+                "id": e["task_id"],
+                "title": e["title"],
+                "description": e["description"] or "",
+                "completed": bool(e["completed"]),
+                "archived": bool(e["archived"]),
+                "user_id": user_id,
+            }
+            for e in entries
+            # the row can be gone if the table was cleared meanwhile
+            if e["op"] == "upsert" and e["title"] is not None
+        ]
+        deletes = [e["task_id"] for e in entries if e["op"] == "delete"]
+        archives = [e["task_id"] for e in entries if e["op"] == "archive"]
+        completes = {True: [], False: []}
+        for e in entries:
+            if e["op"] == "complete" and e["completed"] is not None:
+                completes[bool(e["completed"])].append(e["task_id"])
+
+        client = await self._client()
+        requests = []
+        if upserts:
+            requests.append(
+                self._request(
+                    "supabase.upsert",
+                    len(upserts),
+                    client.table("tasks").upsert(upserts),
+                )
+            )
+        # filtered updates: soft delete (other devices see a tombstone in
+        # their delta), archive, and the completed flag either way
+        updates = [
+            ("supabase.delete", {"deleted": True}, deletes),
+            ("supabase.archive", {"archived": True, "completed": True}, archives),
+            ("supabase.complete", {"completed": True}, completes[True]),
+            ("supabase.complete", {"completed": False}, completes[False]),
+        ]
+        for name, values, ids in updates:
+            # the ids go into the URL; keep it under gateway limits
+            for i in range(0, len(ids), FILTER_IDS_PER_REQUEST):
+                chunk = ids[i:i + FILTER_IDS_PER_REQUEST]
+                requests.append(
+                    self._request(
+                        name,
+                        len(chunk),
+                        client.table("tasks")
+                        .update(values)
+                        .in_("id", chunk)
+                        .eq("user_id", user_id),
+                    )
+                )
+        await asyncio.gather(*requests)
+
+    # -------------------------------------------------
+    # PULL (server -> local)
+    # -------------------------------------------------
+    async def _pull(self, full=False, on_progress=None):
+        """Bring the local store up to date with the server.
+
+        With a stored high-water mark only rows changed since then are
+        fetched (tombstones and archived rows included). Without one, or
+        with full=True, all live, unarchived rows are downloaded page by
+        page. Returns the number of rows
+        received.
+        """
+        user_id = await self._user_id()
+        if not user_id:
+            print("No user found during pull; skipping server fetch.")
+            return 0
+
+        async with self._pull_lock:
+            high_water = None if full else get_sync_high_water(user_id)
+            client = await self._client()
+            if high_water:
+                return await self._pull_delta(client, user_id, high_water)
+            return await self._download(client, user_id, on_progress)
+
+    async def _pull_archive(self):
+        """Download the user's archived rows into the local archive.
+
+        Delta pulls and realtime already bring archive changes made after
+        the first download; this fills in what was archived before it.
+        """
+        user_id = await self._user_id()
+        if not user_id:
+            return 0
+
+        async with self._pull_lock:
+            client = await self._client()
+            received, last_id = 0, None
+            while True:
+                query = (
+                    client.table("tasks")
+                    .select(PULL_COLUMNS)
+                    .eq("user_id", user_id)
+                    .eq("deleted", False)
+                    .eq("archived", True)
+                )
+                if last_id is not None:
+                    query = query.gt("id", last_id)
+                res = await self._request(
+                    "supabase.select_archive", 0, query.order("id").limit(PULL_PAGE_SIZE)
+                )
+                rows = _response_data(res)
+                if rows:
+                    apply_remote_changes(rows)
+                    received += len(rows)
+                    last_id = rows[-1]["id"]
+                if len(rows) < PULL_PAGE_SIZE:
+                    return received
+
+    async def _reconcile(self, on_progress=None):
+        """Compare per-bucket digests with the server; fetch stale buckets.
+
+        A refresh with nothing changed costs one RPC. Without earlier sync
+        state there is nothing to compare, so everything is downloaded.
+        """
+        user_id = await self._user_id()
+        if not user_id:
+            return 0
+
+        async with self._pull_lock:
+            client = await self._client()
+            high_water = get_sync_high_water(user_id)
+            if high_water is None:
+                return await self._download(client, user_id, on_progress)
+
+            res = await self._request(
+                "supabase.digests",
+                0,
+                client.rpc("task_bucket_digests", {"prefix_len": DIGEST_PREFIX_LEN}),
+            )
+            remote, newest = {}, None
+            for r in _response_data(res):
+                if r.get("newest") and (newest is None or r["newest"] > newest):
+                    newest = r["newest"]
+                # buckets holding only tombstones count as empty
+                if r.get("rows"):
+                    remote[r["bucket"]] = (r["rows"], r["digest"])
+            local = bucket_digests(DIGEST_PREFIX_LEN)
+            stale = sorted(
+                b for b in remote.keys() | local.keys() if remote.get(b) != local.get(b)
+            )
+
+            received = sum(
+                await asyncio.gather(*(self._sync_bucket(client, user_id, b) for b in stale))
+            )
+            if newest and newest > high_water:
+                set_sync_high_water(user_id, newest)
+            return received
+
+    async def _sync_bucket(self, client, user_id, prefix):
+        """Download one bucket's live rows and make the local bucket match."""
+        low, high = bucket_bounds(prefix)
+        rows, last_id = [], None
+        while True:
+            query = (
+                client.table("tasks")
+                .select(PULL_COLUMNS)
+                .eq("user_id", user_id)
+                .eq("deleted", False)
+                .eq("archived", False)
+                .gte("id", low)
+                .lte("id", high)
+            )
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            res = await self._request(
+                "supabase.select", 0, query.order("id").limit(PULL_PAGE_SIZE)
+            )
+            page = _response_data(res)
+            rows.extend(page)
+            if len(page) < PULL_PAGE_SIZE:
+                break
+            last_id = page[-1]["id"]
+        replace_bucket(prefix, rows)
+        return len(rows)
+
+    # -------------------------------------------------
+    # REALTIME (server -> local, pushed)
+    # -------------------------------------------------
+    async def _listen(self, feed, on_status=None):
+        user_id = await self._user_id()
+        if not user_id:
+            return
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def emit(kind, value):
+            loop.call_soon_threadsafe(events.put_nowait, (kind, value))
+
+        def report(state):
+            if on_status is not None:
+                self._dispatch(lambda: on_status(state))
+
+        delay = REALTIME_RETRY_MIN
+        try:
+            while True:
+                try:
+                    await feed.open(self._client, user_id, emit)
+                    delay = await self._consume(events, report, delay)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("Realtime feed error:", e)
+                await feed.close()
+                report("disconnected")
+                # drop what the closed feed left behind
+                events = asyncio.Queue()
+                await asyncio.sleep(delay)
+                delay = min(REALTIME_RETRY_MAX, delay * 2)
+        finally:
+            await feed.close()
+
+    async def _consume(self, events, report, delay):
+        """Apply feed events until it disconnects; returns the next backoff."""
+        while True:
+            # take a whole burst at once, without waiting for more
+            batch = [await events.get()]
+            while not events.empty():
+                batch.append(events.get_nowait())
+            rows = []
+            for kind, value in batch:
+                if kind == "change":
+                    rows.append(value)
+                    continue
+                self._apply_pushed(rows)
+                rows = []
+                if value == "disconnected":
+                    return delay
+                # (re)connected: fetch whatever changed while we were away
+                delay = REALTIME_RETRY_MIN
+                report("connected")
+                await self._pull()
+            self._apply_pushed(rows)
+
+    def _apply_pushed(self, rows):
+        if rows:
+            with span("realtime.apply") as s:
+                s["rows"] = len(rows)
+                apply_remote_changes(rows)
+
+    async def _pull_delta(self, client, user_id, high_water):
+        """Fetch rows changed since high_water in (updated_at, id) keyset pages.
+
+        Each page is applied with the high-water mark it reaches, so an
+        interrupted pull resumes where it stopped.
+        """
+        received, last = 0, None
+        while True:
+            query = client.table("tasks").select(PULL_COLUMNS).eq("user_id", user_id)
+            if last is None:
+                # gte, not gt: rows sharing the boundary timestamp may have
+                # committed after our last pull; re-applying them is harmless
+                query = query.gte("updated_at", high_water)
+            else:
+                updated_at, last_id = last
+                query = query.or_(
+                    f'updated_at.gt."{updated_at}",'
+                    f'and(updated_at.eq."{updated_at}",id.gt.{last_id})'
+                )
+            res = await self._request(
+                "supabase.select",
+                0,
+                query.order("updated_at").order("id").limit(PULL_PAGE_SIZE),
+            )
+            rows = _response_data(res)
+
+            with transaction():
+                apply_remote_changes(rows)
+                newest = max(
+                    (r["updated_at"] for r in rows if r.get("updated_at")), default=None
+                )
+                if newest:
+                    set_sync_high_water(user_id, newest)
+            received += len(rows)
+            if len(rows) < PULL_PAGE_SIZE:
+                return received
+            last = (rows[-1]["updated_at"], rows[-1]["id"])
+
+    async def _download(self, client, user_id, on_progress=None):
+        """Download every live, unarchived row in id-keyset pages.
+
+        Each page is committed as soon as it arrives, so the list fills in
+        progressively and memory stays at one page. on_progress(received,
+        total) is dispatched after every page (total may be None).
+        """
+        # anything changed after this point is left for the next delta pull
+        res = await self._request(
+            "supabase.select",
+            0,
+            client.table("tasks")
+            .select("updated_at")
+            .eq("user_id", user_id)
+            .order("updated_at", desc=True)
+            .limit(1),
+        )
+        latest = _response_data(res)
+        high_water = latest[0]["updated_at"] if latest else None
+
+        begin_snapshot()
+        received, total, last_id = 0, None, None
+        while True:
+            query = (
+                client.table("tasks")
+                # exact count only on the first page, for the progress bar
+                .select(PULL_COLUMNS, count="exact" if last_id is None else None)
+                .eq("user_id", user_id)
+                .eq("deleted", False)
+                .eq("archived", False)
+            )
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            res = await self._request(
+                "supabase.select", 0, query.order("id").limit(PULL_PAGE_SIZE)
+            )
+            rows = _response_data(res)
+            if last_id is None:
+                total = getattr(res, "count", None)
+
+            if rows:
+                apply_snapshot_page(rows)
+                received += len(rows)
+                last_id = rows[-1]["id"]
+            if on_progress is not None:
+                self._dispatch(lambda r=received, t=total: on_progress(r, t))
+            if len(rows) < PULL_PAGE_SIZE:
+                break
+
+        finish_snapshot()
+        if high_water:
+            set_sync_high_water(user_id, high_water)
+        return received
+
+
+sync_engine = SyncEngine()
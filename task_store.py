@@ -0,0 +1,202 @@
+"""In-memory, write-through cache of the current store's tasks (no Kivy needed).
+
+The screen reads rows for display and editing from here instead of
+querying SQLite. Writes go through database.py as group-committed writes
+(see database.submit_write); the store listens to its change
+notifications and re-reads only the rows that changed, whichever thread
+wrote them (UI or sync). Rows are compact __slots__ objects kept
+in an id -> row dict whose order is insertion order (oldest first).
+"""
+import threading
+from typing import Dict, List, Optional
+
+from database import (
+    iter_tasks_local,
+    get_tasks_local,
+    add_task_local,
+    update_task_local,
+    delete_task_local,
+    complete_tasks_local,
+    delete_tasks_local,
+    restore_archived,
+    add_change_listener,
+    remove_change_listener,
+    submit_write,
+)
+from stats import span
+
+# Task fields held in memory
+STORE_COLUMNS = ("id", "title", "description", "completed", "synced")
+
+
+class TaskRow:
+    """One task; read-only by convention (changes replace the object).
+
+    Supports task["title"] and task.get("title") so code written
+    against task dicts keeps working.
+    """
+
+    __slots__ = STORE_COLUMNS
+
+    def __init__(self, id, title, description, completed, synced):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.completed = completed
+        self.synced = synced
+
+    @classmethod
+    def from_dict(cls, task: Dict) -> "TaskRow":
+        return cls(
+            task["id"],
+            task.get("title"),
+            task.get("description") or "",
+            1 if task.get("completed") else 0,
+            1 if task.get("synced") else 0,
+        )
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+class TaskStore:
+    """Loads once, then stays current through database change notifications.
+
+    version increases with every applied change, so callers can cache
+    anything derived from the rows and rebuild it only when it moved.
+    Listeners get the same (op, task_id) lists as database listeners,
+    after the store has been updated, on the writing thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = None  # id -> TaskRow, None until loaded
+        self._ordered = None  # (version, rows newest first)
+        self._listeners = []
+        self.version = 0
+        add_change_listener(self._on_db_change)
+
+    def close(self):
+        """Stop following database changes (for stores other than task_store)."""
+        remove_change_listener(self._on_db_change)
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    # -------------------------------------------------
+    # READS (from memory)
+    # -------------------------------------------------
+    def load(self):
+        """(Re)read every task from SQLite."""
+        # holding the lock makes concurrent writers wait to patch until
+        # the load is in, so no change slips between read and install
+        with self._lock, span("store.load") as s:
+            # iter_tasks_local is newest first; the index keeps oldest first
+            rows = [TaskRow.from_dict(t) for t in iter_tasks_local(columns=STORE_COLUMNS)]
+            rows.reverse()
+            self._index = {r.id: r for r in rows}
+            self.version += 1
+            s["rows"] = len(rows)
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._index is None:
+                self.load()
+            return self._index
+
+    def get(self, task_id: str) -> Optional[TaskRow]:
+        return self._ensure_loaded().get(task_id)
+
+    def rows(self) -> List[TaskRow]:
+        """All tasks, most recent first (cached until the next change)."""
+        with self._lock:
+            index = self._ensure_loaded()
+            cached = self._ordered
+            if cached is None or cached[0] != self.version:
+                cached = self._ordered = (self.version, list(reversed(index.values())))
+            return cached[1]
+
+    def __len__(self):
+        return len(self._ensure_loaded())
+
+    # -------------------------------------------------
+    # WRITES (through to SQLite, group-committed)
+    # -------------------------------------------------
+    # Each returns a Future with the database function's result; the
+    # rows here change once the group is committed.
+    def _write(self, fn, *args, **kw):
+        future = submit_write(fn, *args, **kw)
+        future.add_done_callback(_report_write_error)
+        return future
+
+    def add(self, title: str, description: str = ""):
+        """Future of the new task id."""
+        return self._write(add_task_local, title, description)
+
+    def update(self, task_id: str, title: str = None, description: str = None, completed: bool = None):
+        """Future of the updated row dict (None if the task is gone)."""
+        return self._write(
+            update_task_local, task_id, title=title, description=description, completed=completed
+        )
+
+    def delete(self, task_id: str):
+        return self._write(delete_task_local, task_id)
+
+    def complete_many(self, task_ids, completed: bool = True):
+        """Future of the number of rows changed."""
+        return self._write(complete_tasks_local, list(task_ids), completed)
+
+    def delete_many(self, task_ids):
+        """Future of the number of rows deleted."""
+        return self._write(delete_tasks_local, list(task_ids))
+
+    def restore(self, task_ids):
+        """Future of the number of archived tasks moved back."""
+        return self._write(restore_archived, list(task_ids))
+
+    # -------------------------------------------------
+    # CHANGE NOTIFICATIONS
+    # -------------------------------------------------
+    def _on_db_change(self, changes):
+        with self._lock:
+            if self._index is not None:
+                if any(op == "reset" for op, _ in changes):
+                    self.load()
+                else:
+                    self._apply(changes)
+        for listener in list(self._listeners):
+            try:
+                listener(changes)
+            except Exception as e:
+                print("Task store listener error:", e)
+
+    def _apply(self, changes):
+        ids = {task_id for _, task_id in changes}
+        fresh = {t["id"]: t for t in get_tasks_local(ids, STORE_COLUMNS)}
+        for task_id in ids:
+            task = fresh.get(task_id)
+            if task is None:
+                self._index.pop(task_id, None)
+            else:
+                # replacing keeps the row's position; new ids go last
+                self._index[task_id] = TaskRow.from_dict(task)
+        self.version += 1
+
+
+def _report_write_error(future):
+    error = future.exception()
+    if error is not None:
+        print("Task write failed:", error)
+
+
+task_store = TaskStore()